@@ -8,39 +8,31 @@ from selenium.webdriver.common.by import By
 
 from xvfbwrapper import Xvfb
 
+from profiler import Tracer
+from url_resolver import resolve_url
+
 logging.basicConfig(level=logging.INFO)
 
+# Per-phase spans, enabled with --profile-output
+tracer = Tracer(enabled=False)
+
 
 def carbonResults(url):
+    """
+    Run a single Lighthouse audit on an already resolved URL (see url_resolver.resolve_url).
+    """
     try:
-        url = url.replace(r"http://", "").replace(r"https://", "")
-        url = "https://" + url
         logging.info("carbonResults {}".format(url))
         #res = subprocess.run(["node", "carbon.js", url], capture_output=True, text=True)
-        res = subprocess.run(["./carbon.sh", url], capture_output=True, text=True)
+        with tracer.span("lighthouse", "lighthouse", site=url):
+            res = subprocess.run(["./carbon.sh", url], capture_output=True, text=True)
 
         ret = json.loads(res.stdout)
         ret["url"] = url
-        if ret["score"] == 0:
-            raise ValueError
         return ret
     except Exception as e:
         logging.error("Error {} {}".format(url,e))
-        try:
-            url = url.replace(r"http://", "").replace(r"https://", "")
-            url = "http://" + url
-            logging.info("carbonResults {}".format(url))
-            #res = subprocess.run(
-            #    ["node", "carbon.js", url], capture_output=True, text=True
-            #)
-            res = subprocess.run(["./carbon.sh", url], capture_output=True, text=True)
-
-            ret = json.loads(res.stdout)
-            ret["url"] = url
-            return ret
-        except Exception as e:
-            logging.error("Error {} {}".format(url,e))
-            return {"lighthouse": "Error", "score": 0, "url": url}
+        return {"lighthouse": "Error", "score": 0, "url": url}
 
 
 BI_patterns={
@@ -68,10 +60,13 @@ def fetch_and_search(url, patterns):
 def checkBootstrap2(url):
     logging.info("checkBootstrap2 {}".format(url))
     ret={}
+    site = url
     with Xvfb() as xvfb:
-        webdrv = webdriver.Firefox()
+        with tracer.span("browser_launch", "browser", site=site):
+            webdrv = webdriver.Firefox()
         try:
-            webdrv.get(url)
+            with tracer.span("navigation", "browser", site=site):
+                webdrv.get(url)
             ret["url"] = url
             ret["bootstrapItaliaVariable"]=webdrv.execute_script('return window.BOOTSTRAP_ITALIA_VERSION;')
             ret["bootstrapItaliaMethod"]=webdrv.execute_script('return getComputedStyle(document.body).getPropertyValue("--bootstrap-italia-version");')
@@ -86,13 +81,14 @@ def checkBootstrap2(url):
             logging.debug("js_urls {}".format(js_urls))
             logging.debug("css_urls {}".format(css_urls))
 
-            # Search patterns in JS files
-            for url in js_urls:
-                ret.update(fetch_and_search(url, BI_patterns))
+            with tracer.span("asset_download", "browser", site=site, assets=len(js_urls) + len(css_urls)):
+                # Search patterns in JS files
+                for url in js_urls:
+                    ret.update(fetch_and_search(url, BI_patterns))
 
-            # Search patterns in CSS files
-            for url in css_urls:
-                ret.update(fetch_and_search(url, BI_patterns))
+                # Search patterns in CSS files
+                for url in css_urls:
+                    ret.update(fetch_and_search(url, BI_patterns))
 
             for pat_name in BI_patterns.keys():
                 if pat_name not in ret:
@@ -110,8 +106,14 @@ def checkBootstrap2(url):
 
     return ret
 
-def analyze_url(url):
-    carbonRes = carbonResults(url)
+def analyze_url(url, canonical_url=None):
+    with tracer.span("resolve_url", "probe", site=url):
+        resolved = resolve_url(url, cached=canonical_url)
+    if resolved is None:
+        # No scheme or www. variant answers: skip Lighthouse and the browser
+        return {"url": url, "canonicalUrl": None, "lighthouseScore": 0, "error": "Unreachable"}
+
+    carbonRes = carbonResults(resolved)
 
     # remove useless screenshots
     if "rawResult" in carbonRes:
@@ -140,11 +142,13 @@ def analyze_url(url):
 
     except Exception as e:
         logging.error("Error {}".format(e))
+        res = {"url": carbonRes.get("url", resolved), "lighthouseScore": 0}
 
     #bootstrapRes = checkBootstrap(url)
     #res["bootstrapItalia"] = bootstrapRes
     bootstrapRes2 = checkBootstrap2(res["url"])
     res["bootstrapItalia"] = bootstrapRes2
+    res["canonicalUrl"] = resolved
 
     return res
 
@@ -154,9 +158,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Analyze a single URL.")
     parser.add_argument("url", type=str, help="URL to analyze")
     parser.add_argument("-o", "--output", type=str, help="Output file", default=None)
+    parser.add_argument("--profile-output", type=str, help="Write per-phase spans to this trace file", default=None)
+    parser.add_argument("--canonical-url", type=str, help="Working URL cached by a previous run, probed first", default=None)
     args = parser.parse_args()
 
-    result = analyze_url(args.url)
+    tracer.enabled = args.profile_output is not None
+    result = analyze_url(args.url, args.canonical_url)
+    if args.profile_output:
+        tracer.write(args.profile_output)
     if args.output:
         with open(args.output, "w") as f:
             json.dump(result, f, indent=2)
@@ -0,0 +1,17 @@
+def backoff_delay(consecutive_failures, base, maximum):
+    """
+    Exponential backoff delay for a website that failed consecutive_failures times in a row.
+
+    Args:
+        consecutive_failures (int): Number of consecutive failed crawls (0 means healthy).
+        base: Delay after the first failure (seconds or timedelta).
+        maximum: Upper bound for the delay (same type as base).
+
+    Returns:
+        The delay before the next check, 0 * base when the website is healthy.
+    """
+    if consecutive_failures <= 0:
+        return base * 0
+    # Cap the exponent to avoid huge intermediate values for very old failures.
+    exponent = min(consecutive_failures - 1, 32)
+    return min(base * (2 ** exponent), maximum)
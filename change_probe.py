@@ -0,0 +1,119 @@
+import hashlib
+import logging
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+PROBE_TIMEOUT = 10   # Seconds for each request
+MAX_ASSETS = 20      # Scripts and stylesheets of the homepage checked for changes
+USER_AGENT = "Mozilla/5.0 (compatible; carbonEnti)"
+
+
+class StructureParser(HTMLParser):
+    """
+    Collects the tag structure of a page (tag names, ids and classes, without text or other attributes,
+    which often carry tokens or dates) and the scripts and stylesheets it loads.
+    """
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.structure = hashlib.sha1()
+        self.assets = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        self.structure.update(f"<{tag}#{attrs.get('id') or ''}.{attrs.get('class') or ''}>".encode())
+        asset = None
+        if tag == "script" and attrs.get("src"):
+            asset = attrs["src"]
+        elif tag == "link" and "stylesheet" in (attrs.get("rel") or "").lower() and attrs.get("href"):
+            asset = attrs["href"]
+        if asset and len(self.assets) < MAX_ASSETS:
+            self.assets.append(urljoin(self.base_url, asset))
+
+    def handle_endtag(self, tag):
+        self.structure.update(f"</{tag}>".encode())
+
+
+def _validators(response):
+    return {
+        "etag": response.headers.get("ETag"),
+        "lastModified": response.headers.get("Last-Modified"),
+        "length": response.headers.get("Content-Length"),
+    }
+
+
+def _conditional_headers(validators):
+    headers = {"User-Agent": USER_AGENT}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    return headers
+
+
+def fingerprint(url, previous=None, session=None, timeout=PROBE_TIMEOUT):
+    """
+    Return the fingerprint of a site: homepage validators, hash of the HTML structure and validators
+    of its main assets. Conditional requests reuse the parts of previous that did not change.
+    Returns None if the homepage cannot be fetched.
+    """
+    session = session or requests
+    previous = previous or {}
+    try:
+        response = session.get(url, timeout=timeout, headers=_conditional_headers(previous.get("page")))
+    except requests.RequestException as e:
+        logging.debug("fingerprint {} failed: {}".format(url, e))
+        return None
+    if response.status_code == 304 and previous.get("structure"):
+        page, structure, asset_urls = previous["page"], previous["structure"], list(previous.get("assets", {}))
+    elif response.status_code < 400:
+        parser = StructureParser(response.url)
+        parser.feed(response.text)
+        page, structure, asset_urls = _validators(response), parser.structure.hexdigest(), parser.assets
+    else:
+        logging.debug("fingerprint {} returned {}".format(url, response.status_code))
+        return None
+
+    assets = {}
+    for asset_url in asset_urls:
+        old = previous.get("assets", {}).get(asset_url)
+        try:
+            asset = session.head(asset_url, timeout=timeout, allow_redirects=True, headers=_conditional_headers(old))
+            assets[asset_url] = old if asset.status_code == 304 and old else _validators(asset)
+        except requests.RequestException:
+            assets[asset_url] = None
+
+    digest = hashlib.sha1(structure.encode())
+    for asset_url in sorted(assets):
+        digest.update(f"{asset_url}={sorted((assets[asset_url] or {}).items())}".encode())
+    return {"page": page, "structure": structure, "assets": assets, "digest": digest.hexdigest()}
+
+
+def unchanged(url, previous, session=None):
+    """
+    Probe a site against the fingerprint of its last audit.
+    Returns (True if nothing relevant changed, new fingerprint or None).
+    """
+    current = fingerprint(url, previous, session)
+    return bool(previous and current and current["digest"] == previous.get("digest")), current
+
+
+def revalidate(record, url, now, max_carry_forward):
+    """
+    Check an entity result (entiRes/<Codice_IPA>.json) whose TTL expired against its site.
+    If the site did not change and the last full audit is younger than max_carry_forward seconds,
+    return the record carried forward (new ts, auditTs kept, revalidated); otherwise None.
+    """
+    audit_ts = record.get("auditTs", record.get("ts"))
+    if not url or not record.get("fingerprint") or not record.get("lighthouseScore") \
+            or now - audit_ts >= max_carry_forward:
+        return None
+    same, current = unchanged(url, record["fingerprint"])
+    if not same:
+        logging.info("revalidate {}: changed since the last audit".format(url))
+        return None
+    logging.info("revalidate {}: unchanged, carrying the last audit forward".format(url))
+    return dict(record, ts=now, auditTs=audit_ts, revalidated=True, fingerprint=current)
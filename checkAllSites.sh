@@ -1,4 +1,5 @@
 #! /bin/bash
 
-echo Codice_IPA,HTTPCode,CurlExitStatus
-csvcut -c "Codice_IPA,Sito_istituzionale" enti.csv | csvtool drop 1 - | csvtool call  'bash checkSite.sh' -
+# Writes Codice_IPA,HTTPCode,CurlExitStatus for every entity of enti.csv to stdout,
+# checking the sites concurrently (see check_sites.py for the options).
+python3 check_sites.py enti.csv "$@"
@@ -0,0 +1,153 @@
+import argparse
+import csv
+import socket
+import ssl
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.client import RemoteDisconnected
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from registry import load_registry
+
+MAX_WORKERS = 64      # Concurrent checks over the whole registry
+MAX_PER_HOST = 2      # Concurrent checks against the same host
+TIMEOUT = 30          # Seconds for connect and for read
+USER_AGENT = "curl/8.5.0"
+
+# curl exit statuses used in entiCheck.csv (see CurlExitStatuses.csv)
+CURL_OK = 0
+CURL_UNSUPPORTED_PROTOCOL = 1
+CURL_URL_MALFORMED = 3
+CURL_COULDNT_RESOLVE_HOST = 6
+CURL_COULDNT_CONNECT = 7
+CURL_OPERATION_TIMEDOUT = 28
+CURL_SSL_CONNECT_ERROR = 35
+CURL_GOT_NOTHING = 52
+CURL_RECV_ERROR = 56
+CURL_PEER_FAILED_VERIFICATION = 60
+
+
+def _causes(exc):
+    """
+    Yield the exception, its chained causes and the exceptions wrapped in args (requests/urllib3 style).
+    """
+    seen = set()
+    stack = [exc]
+    while stack:
+        e = stack.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        yield e
+        stack.extend([e.__cause__, e.__context__, getattr(e, "reason", None)])
+        stack.extend(arg for arg in getattr(e, "args", ()) if isinstance(arg, BaseException))
+
+
+def curl_exit_status(exc):
+    """
+    Map an exception raised by requests to the exit status curl would have returned.
+    """
+    causes = list(_causes(exc))
+    text = " ".join(str(e) for e in causes)
+    if isinstance(exc, requests.exceptions.InvalidSchema):
+        return CURL_UNSUPPORTED_PROTOCOL
+    if isinstance(exc, (requests.exceptions.MissingSchema, requests.exceptions.InvalidURL, ValueError)):
+        return CURL_URL_MALFORMED
+    if isinstance(exc, requests.exceptions.SSLError) or any(isinstance(e, ssl.SSLError) for e in causes):
+        if any(isinstance(e, ssl.SSLCertVerificationError) for e in causes) or "CERTIFICATE_VERIFY_FAILED" in text:
+            return CURL_PEER_FAILED_VERIFICATION
+        return CURL_SSL_CONNECT_ERROR
+    if isinstance(exc, requests.exceptions.Timeout) or any(isinstance(e, socket.timeout) for e in causes):
+        return CURL_OPERATION_TIMEDOUT
+    if any(isinstance(e, socket.gaierror) for e in causes) or "Name or service not known" in text \
+            or "NameResolutionError" in text or "nodename nor servname" in text:
+        return CURL_COULDNT_RESOLVE_HOST
+    if any(isinstance(e, RemoteDisconnected) for e in causes):
+        return CURL_GOT_NOTHING
+    if any(isinstance(e, ConnectionResetError) for e in causes) or isinstance(exc, requests.exceptions.ChunkedEncodingError):
+        return CURL_RECV_ERROR
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return CURL_COULDNT_CONNECT
+    return CURL_RECV_ERROR
+
+
+class SiteChecker:
+    """
+    Checks many sites concurrently with a pooled HTTP client, limiting the concurrency per host.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST, timeout=TIMEOUT):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_per_host, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def _host_limit(self, host):
+        with self.lock:
+            return self.host_limits.setdefault(host, threading.Semaphore(self.max_per_host))
+
+    def check(self, url):
+        """
+        Return (HTTPCode, CurlExitStatus) like `curl -I -s -o /dev/null -w "%{http_code}" url`.
+        Redirects are not followed; a HEAD refused by the server is retried with GET.
+        """
+        if not url or not url.strip():
+            return "000", CURL_URL_MALFORMED
+        url = url.strip()
+        if "://" not in url:
+            url = "http://" + url  # curl's default scheme
+        try:
+            host = urlsplit(url).hostname
+        except ValueError:
+            return "000", CURL_URL_MALFORMED
+        if not host:
+            return "000", CURL_URL_MALFORMED
+
+        with self._host_limit(host):
+            try:
+                response = self.session.head(url, timeout=self.timeout, allow_redirects=False)
+                if response.status_code in (405, 501):
+                    response = self.session.get(url, timeout=self.timeout, allow_redirects=False, stream=True)
+                    response.close()
+            except Exception as e:
+                return "000", curl_exit_status(e)
+        return f"{response.status_code:03d}", CURL_OK
+
+    def check_all(self, sites):
+        """
+        Check (Codice_IPA, url) pairs and yield (Codice_IPA, HTTPCode, CurlExitStatus) in input order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(lambda site: (site[0], *self.check(site[1])), sites)
+            yield from results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the reachability of every site of the registry (entiCheck.csv).")
+    parser.add_argument("registry", nargs="?", default="enti.csv")
+    parser.add_argument("-o", "--output", default=None, help="Output CSV (default: stdout)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--per-host", type=int, default=MAX_PER_HOST)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT)
+    args = parser.parse_args()
+
+    sites = [(ente.Codice_IPA, ente.Sito_istituzionale) for ente in load_registry(args.registry)]
+    checker = SiteChecker(args.workers, args.per_host, args.timeout)
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(["Codice_IPA", "HTTPCode", "CurlExitStatus"])
+    for row in checker.check_all(sites):
+        writer.writerow(row)
+    if args.output:
+        out.close()
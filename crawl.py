@@ -1,13 +1,18 @@
 import argparse
 import yaml
-import pandas as pd
 import os
 import json
 import subprocess
 from datetime import datetime
+from backoff import backoff_delay
+from change_probe import fingerprint, revalidate
+from planner import bounded_map, shuffled
+from registry import iter_registry
+from registry_sync import load_changes, prune_changes
+from url_resolver import resolve_url
 import re
 import logging
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from xvfbwrapper import Xvfb
 
@@ -29,9 +34,8 @@ def parseArguments():
 
 
 def carbonResults(url):
+    # Single Lighthouse run on the URL found by url_resolver.resolve_url
     try:
-        url = url.replace(r"http://", "").replace(r"https://", "")
-        url = "https://" + url
         logging.info(url)
         res = subprocess.run(["node", "carbon.js", url], capture_output=True, text=True)
 
@@ -39,20 +43,8 @@ def carbonResults(url):
         ret["url"] = url
         return ret
     except (subprocess.SubprocessError, json.JSONDecodeError, AttributeError):
-        try:
-            url = url.replace(r"http://", "").replace(r"https://", "")
-            url = "http://" + url
-            logging.info(url)
-            res = subprocess.run(
-                ["node", "carbon.js", url], capture_output=True, text=True
-            )
-
-            ret = json.loads(res.stdout)
-            ret["url"] = url
-            return ret
-        except (subprocess.SubprocessError, json.JSONDecodeError, AttributeError):
-            logging.error("Error {}".format(url))
-            return {"lighthouse": "Error", "score": 0, "url": url}
+        logging.error("Error {}".format(url))
+        return {"lighthouse": "Error", "score": 0, "url": url}
 
 
 def checkBootstrap(url):
@@ -135,33 +127,55 @@ def checkBootstrap2(url):
 
     return ret
 
-def crawlComune(comune, outputDir, cfg):
-    logging.info("crawlComune {}".format(comune["Denominazione_ente"]))
+def crawlComune(comune, outputDir, cfg, forceSince=None):
+    logging.info("crawlComune {}".format(comune.Denominazione_ente))
     tsNow = datetime.now().timestamp()
-    codiceIPA = comune["Codice_IPA"]
+    codiceIPA = comune.Codice_IPA
     rerun = True
+    failures = 0
+    canonicalUrl = None
     with open(os.path.join(outputDir, codiceIPA + ".json"), "a+") as f:
         try:
             f.seek(0)
             existData = json.load(f)
             ts = existData["ts"]
+            failures = existData.get("consecutiveFailures", 0)
+            canonicalUrl = existData.get("canonicalUrl")
+            ttl = max(cfg["TTL"], backoff_delay(failures, cfg["TTL"], cfg.get("maxBackoff", cfg["TTL"])))
             logging.info(
-                "tsNow {} ts {} diff {} TTL {}".format(
-                    tsNow, ts, tsNow - ts, cfg["TTL"]
+                "tsNow {} ts {} diff {} TTL {} failures {}".format(
+                    tsNow, ts, tsNow - ts, ttl, failures
                 )
             )
-            if (tsNow - ts) < cfg["TTL"]:
+            if forceSince is not None and ts < forceSince:
+                # Changed in the registry since the last crawl: the cached URL may be stale
+                canonicalUrl = None
+            elif (tsNow - ts) < ttl:
                 rerun = False
+            elif cfg.get("maxCarryForward"):
+                # Unchanged homepage and assets: keep the last audit instead of running Lighthouse again
+                carried = revalidate(existData, canonicalUrl, tsNow, cfg["maxCarryForward"])
+                if carried is not None:
+                    rerun = False
+                    f.seek(0)
+                    f.truncate(0)
+                    json.dump(carried, f)
         except json.JSONDecodeError:
             logging.warning("Cannot decode JSON")
             pass
 
         if rerun:
-            carbonRes = carbonResults(comune["Sito_istituzionale"])
-
-            del carbonRes["rawResult"]["audits"]["screenshot-thumbnails"]
-            del carbonRes["rawResult"]["audits"]["final-screenshot"]
-            del carbonRes["rawResult"]["audits"]["full-page-screenshot"]
+            # Probe the scheme / www. variants (the cached URL first) and audit only the working one
+            canonicalUrl = resolve_url(comune.Sito_istituzionale, cached=canonicalUrl)
+            if canonicalUrl is None:
+                carbonRes = {"lighthouse": "Unreachable", "score": 0, "url": comune.Sito_istituzionale}
+            else:
+                carbonRes = carbonResults(canonicalUrl)
+
+            if "rawResult" in carbonRes:
+                del carbonRes["rawResult"]["audits"]["screenshot-thumbnails"]
+                del carbonRes["rawResult"]["audits"]["final-screenshot"]
+                del carbonRes["rawResult"]["audits"]["full-page-screenshot"]
 
             res = None
 
@@ -183,13 +197,29 @@ def crawlComune(comune, outputDir, cfg):
                     "accessibility": carbonRes["rawResult"]["categories"]["accessibility"]["score"],
                     "lighthouseRawResult": carbonRes["rawResult"],
                 }
+                res["consecutiveFailures"] = 0 if carbonRes["score"] else failures + 1
             except KeyError:
                 print("Error carbonRes", carbonRes)
+                # Record the failure so that the TTL backs off for unreachable sites
+                res = {
+                    "Codice_IPA": codiceIPA,
+                    "ts": tsNow,
+                    "url": carbonRes.get("url"),
+                    "lighthouseScore": 0,
+                    "consecutiveFailures": failures + 1,
+                }
 
-            bootstrapRes = checkBootstrap(comune["Sito_istituzionale"])
-            res["bootstrapItalia"] = bootstrapRes
-            bootstrapRes2 = checkBootstrap2(comune["Sito_istituzionale"])
-            res["bootstrapItalia2"] = bootstrapRes2
+            res["canonicalUrl"] = canonicalUrl
+            if canonicalUrl is not None:
+                bootstrapRes = checkBootstrap(canonicalUrl)
+                res["bootstrapItalia"] = bootstrapRes
+                bootstrapRes2 = checkBootstrap2(canonicalUrl)
+                res["bootstrapItalia2"] = bootstrapRes2
+                if cfg.get("maxCarryForward") and res.get("lighthouseScore"):
+                    # Fingerprint of the audited site, compared by the next revalidation
+                    res["fingerprint"] = fingerprint(canonicalUrl)
+                    res["auditTs"] = tsNow
+                    res["revalidated"] = False
 
             if res is not None:
                 print(res)
@@ -206,12 +236,20 @@ def main():
 
     logging.info(cfg)
 
-    crawlList = pd.read_csv(cfg["list"])
+    # Only the comuni unless crawl.yaml sets other filters
+    filters = cfg.get("filters", {"Codice_natura": [2430]})
 
-    comuniList = crawlList[crawlList["Codice_natura"] == 2430]
+    # Entities added or with a changed URL in the registry go first (see registry_sync.py)
+    changesFile = cfg.get("registryChanges", "registry_changes.json")
+    priority = load_changes(changesFile)["priority"]
+    if priority:
+        logging.info("{} entities changed in the registry".format(len(priority)))
 
-    # Randomize list
-    comuniList = comuniList.sample(frac=1).reset_index(drop=True)
+    def plannedComuni():
+        # The registry is streamed instead of being held in memory: changed entities, then the others (see shuffled)
+        if priority:
+            yield from (c for c in iter_registry(cfg["list"], filters) if c.Codice_IPA in priority)
+        yield from shuffled(lambda: (c for c in iter_registry(cfg["list"], filters) if c.Codice_IPA not in priority))
 
     outputDir = cfg["outputDir"]
 
@@ -220,13 +258,26 @@ def main():
     except OSError:
         pass
 
-    tp = ThreadPool()
-    for idx, comune in comuniList.iterrows():
-        tp.apply_async(crawlComune, (comune, outputDir, cfg))
-        #crawlComune(comune, outputDir, cfg)
+    workers = cfg.get("workers", os.cpu_count())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        crawl = lambda comune: crawlComune(
+            comune, outputDir, cfg, priority.get(comune.Codice_IPA, {}).get("detected")
+        )
+        for future in bounded_map(executor, crawl, plannedComuni(), 2 * workers):
+            if future.exception() is not None:
+                logging.error("crawlComune failed: {}".format(future.exception()))
 
-    tp.close()
-    tp.join()
+    # Changed entities crawled since their change are not prioritized any more
+    crawled = {}
+    for codiceIPA in priority:
+        try:
+            with open(os.path.join(outputDir, codiceIPA + ".json"), "r") as f:
+                crawled[codiceIPA] = json.load(f).get("ts")
+        except (OSError, json.JSONDecodeError):
+            pass
+    pruned = prune_changes(crawled, changesFile)
+    if pruned:
+        logging.info("{} changed entities crawled, removed from {}".format(pruned, changesFile))
 
 
 if __name__ == "__main__":
@@ -1,21 +1,28 @@
 import csv
 import os
 import json
+import random
 import subprocess
 from datetime import datetime
-import random
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from planner import bounded_map
+from url_resolver import canonical_target
 
 CSV_FILE = 'enti.csv'
 RESULTS_DIR = 'entiRes2'
 TIME_THRESHOLD = 864000  # 10 days in seconds
 MAX_WORKERS = 2  # Number of parallel processes
+MAX_IN_FLIGHT = 2 * MAX_WORKERS  # Targets submitted to the pool and not yet completed
 
 def get_current_timestamp():
     return int(datetime.now().timestamp())
 
 def process_csv(file_path):
-    tasks = []
+    """
+    Yield one task per unique target: (Sito_istituzionale, [Codice_IPA of the entities sharing it]),
+    in random order. Only the compact grouping index is kept in memory; tasks are created as they are consumed.
+    """
+    targets = {}
     with open(file_path, mode='r', newline='', encoding='utf-8') as file:
         reader = csv.DictReader(file)
         for row in reader:
@@ -23,12 +30,36 @@ def process_csv(file_path):
             sito_istituzionale = row['Sito_istituzionale']
             if not sito_istituzionale.startswith(('http://', 'https://')):
                 sito_istituzionale = 'https://' + sito_istituzionale
-            tasks.append((codice_ipa, sito_istituzionale))
-    return tasks
+            key = canonical_target(sito_istituzionale)
+            targets.setdefault(key, (sito_istituzionale, []))[1].append(codice_ipa)
+    keys = list(targets)
+    random.shuffle(keys)
+    for key in keys:
+        yield targets.pop(key)
+
+def process_target(task):
+    """
+    Run the audit once for a target shared by several entities and copy the report to the others.
+    """
+    sito_istituzionale, codici_ipa = task
+    stale = [codice_ipa for codice_ipa in codici_ipa if needs_rerun(codice_ipa)]
+    if not stale:
+        return
+    source = stale[0]
+    if not call_external_script(source, sito_istituzionale):
+        return
+    with open(os.path.join(RESULTS_DIR, f"{source}.json"), 'r', encoding='utf-8') as json_file:
+        data = json.load(json_file)
+    for codice_ipa in stale[1:]:
+        # Provenance: the report was produced for another entity with the same site
+        shared = dict(data, sharedFrom=source)
+        with open(os.path.join(RESULTS_DIR, f"{codice_ipa}.json"), 'w', encoding='utf-8') as json_file:
+            json.dump(shared, json_file)
+    if len(stale) > 1:
+        print(f"Report of {source} shared with {len(stale) - 1} entities with the same site.")
 
-def process_codice_ipa(task):
+def needs_rerun(codice_ipa):
     rerun=True
-    codice_ipa, sito_istituzionale = task
     json_file_path = os.path.join(RESULTS_DIR, f"{codice_ipa}.json")
     if os.path.isfile(json_file_path):
         with open(json_file_path, 'r', encoding='utf-8') as json_file:
@@ -42,22 +73,21 @@ def process_codice_ipa(task):
                 print(f"No 'ts' attribute found in {json_file_path}.")
     else:
         print(f"No file found for {codice_ipa}.")
-    if rerun:
-        call_external_script(codice_ipa, sito_istituzionale)
+    return rerun
 
 def call_external_script(codice_ipa, sito_istituzionale):
     output_file = f"{codice_ipa}.json"
     try:
         subprocess.run(['./script.sh', codice_ipa, sito_istituzionale, RESULTS_DIR, output_file], check=True)
         print(f"Script executed for {codice_ipa}, results saved to {output_file}.")
+        return True
     except subprocess.CalledProcessError as e:
         print(f"Error executing script for {codice_ipa}: {e}")
+        return False
 
 if __name__ == "__main__":
     tasks = process_csv(CSV_FILE)
-    random.shuffle(tasks)
     with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_codice_ipa, task) for task in tasks]
-        for future in as_completed(futures):
+        for future in bounded_map(executor, process_target, tasks, MAX_IN_FLIGHT):
             future.result()  # To raise exceptions if any
 
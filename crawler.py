@@ -1,14 +1,28 @@
 import threading
 import signal
-from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError
 from datetime import datetime, timedelta
 import subprocess
 import json
 import pymongo
 import psutil
 from logger_setup import setup_logger
+from backoff import backoff_delay
+from metrics import MetricsRegistry
+from profiler import Tracer
+from scheduler import DeadlineExceeded, LaneScheduler
+from sandbox import SANDBOX_CGROUP, Sandbox, setup_cgroup_parent
+from retry_policy import MAX_TEST_ATTEMPTS, TRANSIENT, RetryLane, classify_failure, retry_delay
+from results_store import RESULTS_DATASET_DIR, ResultsWriter, row_from_crawl_result
+from timeseries import TIMESERIES_DIR, ingest as ingest_timeseries
+from url_resolver import resolve_url, resolved_target
+from change_probe import unchanged
+from sampling import SAMPLING_DIR, draw_sample, write_weights
+from zygote import ZygoteClient
 import os
 import argparse
+import socket
 import sys
 import time
 
@@ -16,21 +30,89 @@ import time
 MONGO_URI = "mongodb://localhost:27017"
 DB_NAME = "website_crawler"
 CRAWL_INTERVAL = timedelta(days=30)
+MAX_CARRY_FORWARD = timedelta(days=90)  # Oldest full audit carried forward to a crawl when the site did not change
 MAX_WORKERS = 4                # Website-level executor max workers
 MAX_CPU_USAGE = 80
 MAX_RAM_USAGE = 80
 TEST_TIMEOUT = 120             # Timeout for each test in seconds
 MAX_CONCURRENT_TESTS = 5      # Maximum number of test tasks running concurrently
 MAX_QUEUE_SIZE = 50          # Maximum number of website tasks allowed in the queue
+METRICS_PORT = 9108            # Local port for the metrics endpoint (0 disables it)
+RETRY_LANE_FACTOR = 4          # Retry lanes get 1/4 of the weight of their test lane and 4 times its cost
+SHARED_RESULTS_CACHE = 5000    # Finished shared tests kept for the entities claiming the same target later
+MAX_PROBE_WORKERS = 8          # Workers resolving and fingerprinting websites before their tests are scheduled
+CHRONIC_FAILURE_THRESHOLD = 3  # Consecutive unreachable crawls after which only RECHECK_TESTS are run
+RECHECK_BASE_INTERVAL = timedelta(days=1)   # Delay before rechecking a website after its first failure
+RECHECK_MAX_INTERVAL = timedelta(days=180)  # Upper bound for the exponential recheck backoff
+LEASE_DURATION = timedelta(minutes=10)  # Distributed mode: a website not renewed for this long is reclaimed
+HEARTBEAT_INTERVAL = 60        # Distributed mode: seconds between lease renewals
+LEASE_POLL_INTERVAL = 30       # Distributed mode: seconds to wait for other nodes' leases to finish or expire
+MAX_LEASED_WEBSITES = MAX_QUEUE_SIZE  # Distributed mode: websites leased and not yet finished by a node
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}"  # Owner of the leases taken by this process
+
+REGISTRY_FILE = "enti.csv"     # IndicePA registry, used to stratify the sample of --sample
 
 # Directory containing test scripts
 TESTS_DIR = "tests"
 
+# Test dependency DAG: each test runs only after all of its prerequisites succeeded.
+# When a prerequisite fails, the dependent tests are recorded as skipped without running.
+# Keep the keys in topological order.
+TEST_DEPENDENCIES = {
+    "test_dns": [],
+    "test_http": ["test_dns"],
+    "test_ssl": ["test_dns"],
+    "test_bootstrapitalia": ["test_http"],
+    "test_react_bootstrapitalia": ["test_http"],
+    "test_lighthouse": ["test_bootstrapitalia", "test_react_bootstrapitalia"],
+}
+
+# Scheduling lanes of the test workers, one per test type. Lanes with queued tests share the workers
+# in proportion to their weight; limit caps the workers a lane may hold, so that slow tests always leave
+# room for quick ones. cost is the typical run time in seconds: in deadline mode cheaper lanes go first.
+TEST_LANES = {
+    "test_dns": {"weight": 4, "cost": 1},
+    "test_http": {"weight": 4, "cost": 5},
+    "test_ssl": {"weight": 4, "cost": 5},
+    "test_bootstrapitalia": {"weight": 2, "cost": 30, "limit": 3},
+    "test_react_bootstrapitalia": {"weight": 1, "cost": 60, "limit": 2},
+    "test_lighthouse": {"weight": 1, "cost": 120, "limit": 2},
+}
+# Retries of transient failures run on low-priority lanes (<test>_retry) sharing the limit of their test lane
+TEST_LANES.update({
+    f"{test_name}_retry": {"weight": lane["weight"] / RETRY_LANE_FACTOR, "cost": lane["cost"] * RETRY_LANE_FACTOR,
+                           "group": test_name}
+    for test_name, lane in list(TEST_LANES.items())
+})
+
+# Resource limits of the browser tests, each run in its own cgroup v2 sandbox (see sandbox.py).
+# A runaway Chromium is OOM-killed inside its sandbox instead of slowing down the whole node.
+SANDBOX_LIMITS = {
+    "test_bootstrapitalia": {"memory_max": "1536M", "cpu_weight": 50, "cpu_max": "200000 100000",
+                             "pids_max": 256, "tmpfs_size": "512m"},
+    "test_react_bootstrapitalia": {"memory_max": "2G", "cpu_weight": 50, "cpu_max": "200000 100000",
+                                   "pids_max": 256, "tmpfs_size": "512m"},
+    "test_lighthouse": {"memory_max": "2G", "cpu_weight": 50, "cpu_max": "200000 100000",
+                        "pids_max": 256, "tmpfs_size": "512m"},
+}
+
+# Cheap tests run on chronically unreachable websites; the full suite follows only if they all succeed.
+# A website is considered unreachable in a crawl when any of these tests did not succeed.
+RECHECK_TESTS = ["test_dns", "test_http"]
+
 # MongoDB Connection
 client = pymongo.MongoClient(MONGO_URI)
 db = client[DB_NAME]
 websites_collection = db["websites"]
 results_collection = db["crawl_results"]
+queue_collection = db["test_queue"]   # One item per (crawl_id, website_id, test_name)
+plans_collection = db["crawl_plans"]  # One document per crawl_id, complete once the queue is created
+
+# States of the test queue items
+QUEUE_PENDING = "pending"
+QUEUE_RUNNING = "running"
+QUEUE_DONE = "done"
+QUEUE_FAILED = "failed"
 
 # Initialize logger
 logger = setup_logger("crawler")
@@ -38,6 +120,108 @@ logger = setup_logger("crawler")
 # Shutdown event for graceful termination
 shutdown_event = threading.Event()
 
+# Metrics exposed on /metrics and dumped as JSON at shutdown
+metrics = MetricsRegistry()
+websites_queued = metrics.gauge("crawler_websites_queued", "Website tasks submitted and not yet completed.")
+tests_queued = metrics.gauge("crawler_tests_queued", "Tests submitted to the test executor and not yet started.", ["test"])
+tests_in_flight = metrics.gauge("crawler_tests_in_flight", "Tests currently running.", ["test"])
+tests_completed = metrics.counter("crawler_tests_completed_total", "Tests completed, by final status.", ["test", "status"])
+tests_timed_out = metrics.counter("crawler_tests_timed_out_total", "Tests killed after TEST_TIMEOUT.", ["test"])
+tests_retried = metrics.counter("crawler_tests_retried_total", "Retries scheduled for transient failures.", ["test"])
+tests_deferred = metrics.counter("crawler_tests_deferred_total", "Tests not started before the crawl deadline.", ["test"])
+sandbox_limits_hit = metrics.counter("crawler_sandbox_limits_hit_total", "Sandboxed tests that hit a resource limit.", ["test", "reason"])
+websites_revalidated = metrics.counter("crawler_websites_revalidated_total", "Unchanged websites whose last audit was carried forward.")
+tests_deduplicated = metrics.counter("crawler_tests_deduplicated_total", "Tests whose result was shared by another entity with the same target URL.", ["test"])
+tests_failed = metrics.counter("crawler_tests_failed_total", "Final test failures, by failure class.", ["test", "failure_class"])
+test_duration = metrics.histogram("crawler_test_duration_seconds", "Wall time of each test run.", ["test"])
+mongo_write_duration = metrics.histogram("crawler_mongo_write_seconds", "Latency of MongoDB writes.", ["operation"])
+child_processes = metrics.gauge(
+    "crawler_child_processes", "Number of child processes of the crawler.",
+    function=lambda: len(psutil.Process().children(recursive=True))
+)
+
+# Per-phase spans, enabled with --profile
+tracer = Tracer(enabled=False)
+
+# Parquet results dataset writer, set up in main() unless disabled
+results_writer = None
+
+# Timer handing the retries of transient failures to their retry lanes, set up in main()
+retry_lane = None
+
+# Executor of the URL and change probes of full crawls, set up in main(); a slow host only holds a probe worker
+probe_executor = None
+
+# Whether SANDBOX_LIMITS are enforced, set in main() once the cgroup parent is set up
+sandbox_enabled = False
+
+# Zygote forking the tests from preloaded modules (--zygote), set up in main()
+zygote = None
+
+class SharedTargets:
+    """
+    Tests of the current run shared by the entities with the same resolved target URL
+    (schools on a shared portal, unioni di comuni, ASL subdivisions...), keyed by resolved_target.
+    The first plan claiming a (target, test) runs it; the others wait for its final result.
+    Once the owner completes it, the result is kept for later claims among the max_finished most recent.
+    """
+
+    def __init__(self, max_finished=SHARED_RESULTS_CACHE):
+        self.lock = threading.Lock()
+        self.tests = {}     # (target, test_name) -> (owner website_id, Future of the final result) while running
+        self.finished = OrderedDict()  # (target, test_name) -> (owner, completed Future), least recent first
+        self.max_finished = max_finished
+        self.resolved = {}  # registry URL -> canonical URL resolved in this run
+
+    def claim(self, target_url, test_name, website_id):
+        """
+        Return (owner website_id, shared Future); the caller runs the test if it is the owner.
+        """
+        key = (resolved_target(target_url), test_name)
+        with self.lock:
+            if key in self.finished:
+                self.finished.move_to_end(key)
+                return self.finished[key]
+            return self.tests.setdefault(key, (website_id, Future()))
+
+    def complete(self, target_url, test_name, result=None, exception=None):
+        """
+        Set the final result (or exception) of a test claimed by the caller; the waiting plans are
+        served by the done-callbacks of the Future before it is dropped. Only results are kept.
+        """
+        key = (resolved_target(target_url), test_name)
+        with self.lock:
+            owner, shared = self.tests.pop(key)
+            if exception is None:
+                self.finished[key] = (owner, shared)
+                if len(self.finished) > self.max_finished:
+                    self.finished.popitem(last=False)
+        if exception is not None:
+            shared.set_exception(exception)
+        else:
+            shared.set_result(result)
+
+    def resolve(self, url, cached):
+        """
+        Resolve a registry URL once per run, whatever the number of entities sharing it.
+        """
+        with self.lock:
+            if url in self.resolved:
+                return self.resolved[url]
+        canonical_url = resolve_url(url, cached=cached)
+        with self.lock:
+            return self.resolved.setdefault(url, canonical_url)
+
+shared_targets = SharedTargets()
+
+# Test plans not finished yet; main() waits for them before shutting down the executors
+active_plans = 0
+plans_condition = threading.Condition()
+
+# Distributed mode: bounds the websites leased by this node, and stops the heartbeat at shutdown
+lease_slots = threading.Semaphore(MAX_LEASED_WEBSITES)
+heartbeat_stop = threading.Event()
+
 def handle_sigterm(signal_number, frame):
     """
     Signal handler for SIGTERM and SIGINT to initiate a graceful shutdown.
@@ -66,42 +250,250 @@ def monitor_resources():
         return False
     return True
 
-def fetch_incomplete_tests(crawl_id):
+def enqueue_tests(crawl_id, website_id, test_names, mode, sample=False, seq=None):
     """
-    Fetch websites with incomplete tests from the previous crawl session.
+    Add pending queue items for tests of a website, keeping the items that already exist.
+    Items of the sample (plan_sample) are run before the others, each group in seq order.
     """
-    logger.info("Fetching websites with incomplete tests...")
-    incomplete_tests = results_collection.find({"crawl_id": crawl_id, "tests.status": {"$ne": "success"}})
-    return [test for test in incomplete_tests]
+    if not test_names:
+        return
+    now = datetime.now()
+    item = {"state": QUEUE_PENDING, "status": None, "attempts": 0, "mode": mode, "sample": sample, "updated_at": now}
+    if seq is not None:
+        item["seq"] = seq
+    queue_collection.bulk_write([
+        pymongo.UpdateOne(
+            {"crawl_id": crawl_id, "website_id": website_id, "test_name": test_name},
+            {"$setOnInsert": item},
+            upsert=True,
+        )
+        for test_name in test_names
+    ], ordered=False)
 
-def fetch_websites_to_crawl(batch_size=100):
+def update_queue_item(crawl_id, website_id, test_name, state, status=None):
     """
-    Incrementally fetch websites that need to be crawled.
+    Move a queue item to a new state; moving to running counts an attempt,
+    moving back to pending (a test deferred without running) gives it back.
     """
-    logger.info("Fetching websites to crawl incrementally...")
-    cutoff_time = datetime.now() - CRAWL_INTERVAL
+    update = {"$set": {"state": state, "status": status, "updated_at": datetime.now()}}
+    if state == QUEUE_RUNNING:
+        update["$inc"] = {"attempts": 1}
+    elif state == QUEUE_PENDING:
+        update["$inc"] = {"attempts": -1}
+    with mongo_write_duration.time(operation="update_queue_item"):
+        queue_collection.update_one(
+            {"crawl_id": crawl_id, "website_id": website_id, "test_name": test_name}, update, upsert=True
+        )
+
+def plan_sample(crawl_id, margin, registry_file=REGISTRY_FILE, sampling_dir=SAMPLING_DIR):
+    """
+    Queue a stratified sample of the registry (see sampling.py) ahead of the rest of the crawl,
+    whether or not its websites are due, and write its sampling weights for the dashboards.
+    The sample is drawn with the crawl_id as seed, so a resumed crawl draws the same one.
+    """
+    plan = plans_collection.find_one({"_id": crawl_id})
+    if plan and plan.get("sample_complete"):
+        return
+    plans_collection.update_one({"_id": crawl_id}, {"$setOnInsert": {"started_at": datetime.now(), "complete": False}}, upsert=True)
+
+    rows = draw_sample(registry_file, margin, seed=crawl_id)
+    path = write_weights(rows, crawl_id, sampling_dir)
+    logger.info(f"Sample of {len(rows)} entities for a +/-{margin:.1%} margin; weights written to {path}.")
 
-    query = {
+    queued = 0
+    for start in range(0, len(rows), 1000):
+        if shutdown_event.is_set():
+            logger.info("Shutdown event detected. Sample planning will be completed on restart.")
+            return
+        codici = [row["Codice_IPA"] for row in rows[start:start + 1000]]
+        for website in websites_collection.find({"Codice_IPA": {"$in": codici}, "removed_at": None}):
+            mode = "recheck" if is_chronic_failure(website) else "full"
+            tests = RECHECK_TESTS if mode == "recheck" else list(TEST_DEPENDENCIES)
+            enqueue_tests(crawl_id, website["_id"], tests, mode, sample=True, seq=queued)
+            queued += 1
+    plans_collection.update_one({"_id": crawl_id}, {"$set": {"sample_complete": True, "sample_size": queued}})
+    logger.info(f"Sample planned: {queued} websites queued first.")
+
+def plan_crawl(crawl_id):
+    """
+    Create the test queue of a crawl once: a pending item for each test of each due website.
+    Items carry the position (seq) of their website in fetch_websites_to_crawl, the order of the crawl.
+    An interrupted planning is completed on restart; a completed one is never repeated.
+    """
+    plan = plans_collection.find_one({"_id": crawl_id})
+    if plan and plan.get("complete"):
+        logger.info(f"Crawl {crawl_id} already planned; resuming from the test queue.")
+        return
+    plans_collection.update_one({"_id": crawl_id}, {"$setOnInsert": {"started_at": datetime.now(), "complete": False}}, upsert=True)
+
+    queued = 0
+    seq = 0
+    for batch in fetch_websites_to_crawl(batch_size=100):
+        if shutdown_event.is_set():
+            logger.info("Shutdown event detected. Crawl planning will be completed on restart.")
+            return
+        now = datetime.now()
+        items = []
+        for website in batch:
+            mode = "recheck" if is_chronic_failure(website) else "full"
+            tests = RECHECK_TESTS if mode == "recheck" else TEST_DEPENDENCIES
+            items += [
+                {"crawl_id": crawl_id, "website_id": website["_id"], "test_name": test_name, "state": QUEUE_PENDING,
+                 "status": None, "attempts": 0, "mode": mode, "seq": seq, "updated_at": now}
+                for test_name in tests
+            ]
+            seq += 1
+        try:
+            queue_collection.insert_many(items, ordered=False)
+        except pymongo.errors.BulkWriteError:
+            pass  # Items already queued before an interruption of the planning
+        queued += len(items)
+    plans_collection.update_one({"_id": crawl_id}, {"$set": {"complete": True, "planned_at": datetime.now()}})
+    logger.info(f"Crawl {crawl_id} planned: {queued} queued tests.")
+
+def fetch_queued_websites(crawl_id, batch_size=100):
+    """
+    Yield (website, queue items) for the websites with unfinished tests in the queue of a crawl.
+    Tests that were running when the crawler stopped are pending again.
+    """
+    reset = queue_collection.update_many(
+        {"crawl_id": crawl_id, "state": QUEUE_RUNNING}, {"$set": {"state": QUEUE_PENDING}}
+    )
+    if reset.modified_count:
+        logger.info(f"Requeued {reset.modified_count} tests interrupted by the previous shutdown.")
+
+    # Websites of the sample (plan_sample) first, then the rest of the crawl, each in planning order (seq)
+    websites = list(queue_collection.aggregate([
+        {"$match": {"crawl_id": crawl_id, "state": QUEUE_PENDING}},
+        {"$group": {"_id": "$website_id", "sample": {"$max": "$sample"}, "seq": {"$min": "$seq"}}},
+        {"$sort": {"sample": -1, "seq": 1}},
+    ], allowDiskUse=True))
+    website_ids = [website["_id"] for website in websites]
+    sampled = sum(1 for website in websites if website.get("sample"))
+    logger.info(f"{len(website_ids)} websites with pending tests in crawl {crawl_id} ({sampled} in the sample).")
+    for start in range(0, len(website_ids), batch_size):
+        if shutdown_event.is_set():
+            break
+        ids = website_ids[start:start + batch_size]
+        items = defaultdict(list)
+        for item in queue_collection.find({"crawl_id": crawl_id, "website_id": {"$in": ids}}):
+            items[item["website_id"]].append(item)
+        found = {website["_id"]: website for website in websites_collection.find({"_id": {"$in": ids}})}
+        for website_id in ids:
+            if website_id in found:
+                yield found[website_id], items[website_id]
+
+def is_chronic_failure(website):
+    """
+    Return True if the website failed enough consecutive crawls to get only a cheap recheck.
+    """
+    return website.get("consecutive_failures", 0) >= CHRONIC_FAILURE_THRESHOLD
+
+def due_websites_query(now):
+    """
+    Query matching the websites that need to be crawled.
+    Healthy websites are due every CRAWL_INTERVAL, failing ones when their backoff (next_check) expires.
+    Websites added or changed in the registry (priority, see registry_sync.py) are always due.
+    """
+    return {
+        "removed_at": None,
         "$or": [
-            {"last_crawl": {"$lt": cutoff_time}},
+            {"priority": {"$gt": 0}},
+            {"last_crawl": {"$lt": now - CRAWL_INTERVAL}, "next_check": None},
+            {"next_check": {"$lte": now}},
             {"last_crawl": None}
         ]
     }
 
-    cursor = websites_collection.find(query).sort("last_crawl", 1)
+def fetch_websites_to_crawl(batch_size=100):
+    """
+    Incrementally fetch websites that need to be crawled, priority websites first.
+    """
+    logger.info("Fetching websites to crawl incrementally...")
+    query = due_websites_query(datetime.now())
+
+    cursor = websites_collection.find(query).sort([("priority", -1), ("last_crawl", 1)])
 
     batch = []
+    planned = {"full": 0, "recheck": 0}
     for website in cursor:
         if shutdown_event.is_set():
             logger.info("Shutdown event detected. Stopping incremental fetch.")
             break
+        planned["recheck" if is_chronic_failure(website) else "full"] += 1
         batch.append(website)
         if len(batch) >= batch_size:
+            logger.info(f"Planned websites so far: {planned['full']} full, {planned['recheck']} recheck only.")
             yield batch
             batch = []
 
     if batch:
         yield batch
+    logger.info(f"Planned websites: {planned['full']} full, {planned['recheck']} recheck only.")
+
+def lease_next_website(crawl_id):
+    """
+    Atomically lease the next due website that no node holds a live lease on.
+    Returns the website document, or None if there is no work available.
+    """
+    now = datetime.now()
+    query = due_websites_query(now)
+    query["$and"] = [{"$or": [{"lease_expires": None}, {"lease_expires": {"$lt": now}}]}]
+    with mongo_write_duration.time(operation="lease_website"):
+        website = websites_collection.find_one_and_update(
+            query,
+            {"$set": {"lease_owner": NODE_ID, "lease_expires": now + LEASE_DURATION, "lease_crawl_id": crawl_id}},
+            sort=[("priority", -1), ("last_crawl", 1)],
+            return_document=pymongo.ReturnDocument.BEFORE,
+        )
+    if website is not None and website.get("lease_owner") not in (None, NODE_ID):
+        logger.info(f"Reclaimed expired lease of {website.get('lease_owner')} on website_id={website['_id']}.")
+    return website
+
+def release_lease(website_id):
+    """
+    Release the lease of this node on a website and free a local lease slot.
+    """
+    websites_collection.update_one(
+        {"_id": website_id, "lease_owner": NODE_ID},
+        {"$set": {"lease_owner": None, "lease_expires": None}}
+    )
+    lease_slots.release()
+
+def heartbeat_leases():
+    """
+    Renew the leases held by this node every HEARTBEAT_INTERVAL until heartbeat_stop is set.
+    """
+    while not heartbeat_stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            websites_collection.update_many(
+                {"lease_owner": NODE_ID},
+                {"$set": {"lease_expires": datetime.now() + LEASE_DURATION}}
+            )
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Lease heartbeat failed: {e}")
+
+def lease_websites(crawl_id):
+    """
+    Yield websites leased from the shared queue, at most MAX_LEASED_WEBSITES unfinished at a time.
+    Stops when no website is due and no other node holds a live lease that could still expire.
+    """
+    while not shutdown_event.is_set():
+        if not lease_slots.acquire(timeout=1):
+            continue
+        website = lease_next_website(crawl_id)
+        if website is not None:
+            yield website
+            continue
+        lease_slots.release()
+        others = websites_collection.count_documents(
+            {"lease_owner": {"$nin": [None, NODE_ID]}, "lease_expires": {"$gt": datetime.now()}}
+        )
+        if others == 0:
+            logger.info("No websites left to lease.")
+            return
+        logger.info(f"No websites to lease; waiting for {others} websites leased by other nodes.")
+        shutdown_event.wait(LEASE_POLL_INTERVAL)
 
 def normalize_url(url):
     """
@@ -117,20 +509,27 @@ def normalize_url(url):
         return f"https://{url}"
     return url
 
-def check_existing_test(website_id, test_name, crawl_id):
+def fetch_existing_tests(website_id, crawl_id):
+    """
+    Return a mapping test_name -> status for the tests of a website already stored during this crawl.
+    """
+    result = results_collection.find_one(
+        {"website_id": website_id, "crawl_id": crawl_id},
+        {"tests.test_name": 1, "tests.status": 1}
+    )
+    if not result:
+        return {}
+    return {test.get("test_name"): test.get("status") for test in result.get("tests", [])}
+
+def has_test_script(test_name):
     """
-    Check if a specific test for a website has already been executed during this crawl.
+    Return True if TESTS_DIR has the script of a test (see run_test_script).
     """
-    result = results_collection.find_one({
-        "website_id": website_id,
-        "crawl_id": crawl_id,
-        "tests": {"$elemMatch": {"test_name": test_name}}
-    })
-    return result is not None
+    return os.path.isfile(os.path.join(TESTS_DIR, f"{test_name}.py"))
 
-def run_test_script(url, test_name, name):
+def run_test_script(url, test_name, name, sandbox=None):
     """
-    Executes a specific test script located in TESTS_DIR for a website.
+    Executes a specific test script located in TESTS_DIR for a website, inside sandbox if given.
     Ensures that all spawned processes are terminated at the end of the test.
     Always returns a dict that includes 'test_name' and 'status'.
     """
@@ -148,7 +547,7 @@ def run_test_script(url, test_name, name):
         }
 
     test_script_path = os.path.join(TESTS_DIR, f"{test_name}.py")
-    if not os.path.isfile(test_script_path):
+    if not has_test_script(test_name):
         logger.error(f"Test script {test_script_path} not found for {name}.")
         return {
             "test_name": test_name,
@@ -161,13 +560,23 @@ def run_test_script(url, test_name, name):
     process = None
     try:
         # Start the test in a new process group.
-        process = subprocess.Popen(
-            ["python3", test_script_path, url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            start_new_session=True
-        )
+        if zygote is not None:
+            # Forked from the zygote in its own process group; the profile tmpfs falls back to /dev/shm
+            try:
+                process = zygote.spawn(test_script_path, [url], env=sandbox.profile_env() if sandbox else None,
+                                       cgroup=sandbox.path if sandbox else None)
+            except OSError as e:
+                logger.warning(f"Zygote unavailable for {test_name} ({e}); starting a new interpreter.")
+        if process is None:
+            command = ["python3", test_script_path, url]
+            process = subprocess.Popen(
+                sandbox.wrap(command) if sandbox else command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                start_new_session=True,
+                env=sandbox.env() if sandbox else None,
+            )
 
         try:
             stdout, stderr = process.communicate(timeout=TEST_TIMEOUT)
@@ -206,13 +615,24 @@ def run_test_script(url, test_name, name):
             return test_result
         else:
             logger.error(f"Test {test_name} failed for {url} ({name}): {stderr}")
-            return {
+            failed_result = {}
+            try:
+                # Tests print their structured result before exiting with 1; keep it for the retry policy
+                failed_result = json.loads(stdout)
+            except (json.JSONDecodeError, TypeError):
+                pass
+            if not isinstance(failed_result, dict):
+                failed_result = {}
+            failed_result.update({
                 "test_name": test_name,
-                "url": url,
+                "url": failed_result.get("url", url),
                 "status": "fail",
-                "error": stderr,
                 "execution_timestamp": execution_timestamp,
-            }
+            })
+            if stderr or "error" not in failed_result:
+                failed_result["stderr"] = stderr
+                failed_result.setdefault("error", stderr)
+            return failed_result
     except Exception as e:
         logger.exception(f"Error running test {test_name} for {url} ({name}): {e}")
         return {
@@ -239,64 +659,508 @@ def run_test_script(url, test_name, name):
             except Exception as cleanup_error:
                 logger.debug(f"Error during process group cleanup for test {test_name}: {cleanup_error}")
 
-def spawn_crawl_script(website, crawl_id, test_executor):
+def run_test(url, test_name, name):
+    """
+    Run a test through run_test_script, in a cgroup sandbox if it has SANDBOX_LIMITS.
+    A failed sandboxed test reports the limit it hit (OOMKilled, PidsLimitReached, CPUThrottled) as its error.
+    """
+    limits = SANDBOX_LIMITS.get(test_name)
+    if not sandbox_enabled or not limits:
+        return run_test_script(url, test_name, name)
+    try:
+        sandbox = Sandbox(test_name, limits)
+    except OSError as e:
+        logger.warning(f"Cannot create the sandbox of {test_name} for {url}: {e}. Running it unconfined.")
+        return run_test_script(url, test_name, name)
+    try:
+        result = run_test_script(url, test_name, name, sandbox)
+    finally:
+        report = sandbox.close()
+    result["sandbox"] = report
+    reason = report["failure_reason"]
+    if reason:
+        sandbox_limits_hit.inc(test=test_name, reason=reason)
+    if reason and result.get("status") == "fail":
+        logger.error(f"Test {test_name} for {url} ({name}) hit its sandbox limit: {reason}.")
+        result["failure_reason"] = reason
+        result["error"] = f"{reason}: {result.get('error')}"
+    return result
+
+def run_test_with_metrics(website_id, url, test_name, name, submitted_us=None):
+    """
+    Run a test through run_test_script, updating the queue, in-flight, duration and completion metrics.
+    When profiling, the time spent in the executor queue and the test run are recorded as spans
+    of the website (site=website_id, like the mongo, parquet and probe spans).
+    """
+    tests_queued.dec(test=test_name)
+    tests_in_flight.inc(test=test_name)
+    if submitted_us is not None:
+        now_us = time.time_ns() // 1000
+        tracer.add_span(test_name, "queue_wait", submitted_us, now_us - submitted_us, site=website_id, url=url)
+    start = time.monotonic()
+    try:
+        with tracer.span(test_name, "test", site=website_id, url=url):
+            result = run_test(url, test_name, name)
+    finally:
+        tests_in_flight.dec(test=test_name)
+        test_duration.observe(time.monotonic() - start, test=test_name)
+    tests_completed.inc(test=test_name, status=result.get("status", "unknown"))
+    if result.get("error") == "TimeoutExpired":
+        tests_timed_out.inc(test=test_name)
+    return result
+
+class SiteTestPlan:
+    """
+    Tracks the execution of the test DAG for a single website during a crawl.
+    Tests are submitted to the test executor as soon as their prerequisites succeed;
+    tests whose prerequisites failed or were skipped are stored as skipped right away.
+    In "recheck" mode only RECHECK_TESTS are run, and the plan is extended to the full
+    suite if they all succeed. The outcome is recorded on the website once the plan is done.
+    """
+
+    def __init__(self, website_id, url, name, crawl_id, test_executor, existing_tests=None,
+                 mode="full", consecutive_failures=0, leased=False, attempts=None, fingerprint=None):
+        self.website_id = website_id
+        self.url = url
+        self.name = name
+        self.crawl_id = crawl_id
+        self.test_executor = test_executor
+        self.run_timestamp = datetime.now()
+        self.mode = mode
+        self.tests = list(RECHECK_TESTS) if mode == "recheck" else list(TEST_DEPENDENCIES)
+        self.consecutive_failures = consecutive_failures
+        self.leased = leased
+        # test_name -> status for completed tests (including results stored in a previous run).
+        self.statuses = dict(existing_tests or {})
+        self.submitted = set()
+        # test_name -> number of the next attempt, seeded with the attempts of an interrupted crawl
+        self.attempts = dict(attempts or {})
+        # Tests not started before the crawl deadline, with their dependents; they stay pending in the queue
+        self.deferred = set()
+        # Tests run by this plan on behalf of the entities sharing its target URL (see SharedTargets)
+        self.owned = set()
+        # Fingerprint of the site taken before the tests (see change_probe.py), saved if the crawl succeeds
+        self.fingerprint = fingerprint
+        self.finished = False
+        self.lock = threading.Lock()
+        plan_started()
+
+    def _collect_ready(self):
+        """
+        Walk the DAG in topological order and return (tests to submit, skipped results).
+        Must be called with the lock held.
+        """
+        to_submit = []
+        skipped = []
+        for test_name, prerequisites in TEST_DEPENDENCIES.items():
+            if test_name not in self.tests:
+                continue
+            if test_name in self.statuses or test_name in self.submitted or test_name in self.deferred:
+                continue
+            if any(p in self.deferred for p in prerequisites):
+                self.deferred.add(test_name)
+                continue
+            prerequisite_statuses = {p: self.statuses.get(p) for p in prerequisites}
+            if any(status is None for status in prerequisite_statuses.values()):
+                continue
+            failed = [p for p, status in prerequisite_statuses.items() if status != "success"]
+            if failed:
+                self.statuses[test_name] = "skipped"
+                skipped.append({
+                    "test_name": test_name,
+                    "url": self.url,
+                    "status": "skipped",
+                    "error": f"Prerequisite failed: {', '.join(failed)}",
+                    "execution_timestamp": datetime.now(),
+                })
+            else:
+                self.submitted.add(test_name)
+                to_submit.append(test_name)
+        return to_submit, skipped
+
+    def _step(self):
+        """
+        Return (tests to submit, skipped results, finished), extending a successful recheck
+        to the full suite. Must be called with the lock held.
+        """
+        to_submit, skipped = [], []
+        while True:
+            ready, skip = self._collect_ready()
+            to_submit += ready
+            skipped += skip
+            if self.finished or any(t not in self.statuses and t not in self.deferred for t in self.tests):
+                return to_submit, skipped, False
+            if self.deferred:
+                self.finished = True
+                return to_submit, skipped, True
+            if self.mode == "recheck" and all(self.statuses.get(t) == "success" for t in RECHECK_TESTS):
+                logger.info(f"Website {self.url} recovered; scheduling the full test suite.")
+                self.mode = "full"
+                self.tests = list(TEST_DEPENDENCIES)
+                enqueue_tests(self.crawl_id, self.website_id,
+                              [t for t in self.tests if t not in self.statuses], self.mode)
+                continue
+            self.finished = True
+            return to_submit, skipped, True
+
+    def advance(self):
+        """
+        Submit every test whose prerequisites are satisfied and store the skipped ones.
+        """
+        if shutdown_event.is_set():
+            return
+        with self.lock:
+            to_submit, skipped, finished = self._step()
+        if skipped:
+            logger.info(f"Skipping {[t['test_name'] for t in skipped]} for {self.url}: prerequisites failed.")
+            for test in skipped:
+                tests_completed.inc(test=test["test_name"], status="skipped")
+                update_queue_item(self.crawl_id, self.website_id, test["test_name"], QUEUE_DONE, "skipped")
+            store_crawl_result(self.website_id, self.crawl_id, skipped)
+        for test_name in to_submit:
+            update_queue_item(self.crawl_id, self.website_id, test_name, QUEUE_RUNNING)
+            owner, shared = shared_targets.claim(self.url, test_name, self.website_id)
+            if owner != self.website_id:
+                # Same target as another entity: reuse its result instead of running the test again
+                tests_deduplicated.inc(test=test_name)
+                shared.add_done_callback(lambda f, test_name=test_name, owner=owner: self._on_shared_done(test_name, owner, f))
+                continue
+            self.owned.add(test_name)
+            tests_queued.inc(test=test_name)
+            future = self.test_executor.submit(
+                test_name, run_test_with_metrics, self.website_id, self.url, test_name, self.name,
+                time.time_ns() // 1000
+            )
+            # Attach metadata to the future for later use.
+            future.website_id = self.website_id
+            future.test_name = test_name
+            future.run_timestamp = self.run_timestamp
+            future.add_done_callback(self._on_test_done)
+        if finished and self.deferred:
+            # Partial crawl: last_crawl is not updated so that the website stays due (or leasable) and its
+            # deferred tests run in a resumed crawl; only an unreachable website gets its recheck backoff.
+            # The dataset row is appended when the deferred tests are completed.
+            logger.info(f"Crawl deadline reached for {self.url}; deferred {sorted(self.deferred)}.")
+            if all(t in self.statuses for t in RECHECK_TESTS) \
+                    and any(self.statuses[t] != "success" for t in RECHECK_TESTS):
+                record_crawl_outcome(self.website_id, self.statuses, self.consecutive_failures, self.mode)
+        elif finished:
+            record_crawl_outcome(self.website_id, self.statuses, self.consecutive_failures, self.mode,
+                                 self.crawl_id, self.fingerprint)
+            append_dataset_result(self.website_id, self.crawl_id)
+        if finished:
+            if self.leased:
+                release_lease(self.website_id)
+            plan_finished()
+
+    def _retry(self, test_name, result):
+        """
+        Schedule a retry of a transient failure on the retry lane of the test.
+        Returns False when the failure is permanent or the attempts are exhausted.
+        """
+        attempts = self.attempts.get(test_name, 1)
+        failure_class = classify_failure(result)
+        result["failure_class"] = failure_class
+        result["attempts"] = attempts
+        delay = retry_delay(attempts)
+        remaining = self.test_executor.remaining()
+        if failure_class != TRANSIENT or attempts >= MAX_TEST_ATTEMPTS or retry_lane is None \
+                or shutdown_event.is_set() or (remaining is not None and remaining < delay):
+            tests_failed.inc(test=test_name, failure_class=failure_class)
+            return False
+        logger.info(f"Transient failure of {test_name} for {self.url} (attempt {attempts}); retrying in {delay:.0f}s.")
+        self.attempts[test_name] = attempts + 1
+        tests_retried.inc(test=test_name)
+        tests_queued.inc(test=test_name)
+        update_queue_item(self.crawl_id, self.website_id, test_name, QUEUE_RUNNING)
+        try:
+            future = retry_lane.submit_after(
+                delay, f"{test_name}_retry", run_test_with_metrics, self.website_id, self.url, test_name, self.name,
+                time.time_ns() // 1000
+            )
+        except RuntimeError:
+            tests_queued.dec(test=test_name)
+            return False
+        future.website_id = self.website_id
+        future.test_name = test_name
+        future.run_timestamp = self.run_timestamp
+        future.add_done_callback(self._on_test_done)
+        return True
+
+    def _defer(self, test_name):
+        tests_deferred.inc(test=test_name)
+        update_queue_item(self.crawl_id, self.website_id, test_name, QUEUE_PENDING)
+        with self.lock:
+            self.submitted.discard(test_name)
+            self.deferred.add(test_name)
+        self.advance()
+
+    def _complete(self, test_name, result):
+        store_crawl_result(self.website_id, self.crawl_id, [result])
+        status = result.get("status")
+        if not shutdown_event.is_set():
+            # Tests cut short by a shutdown stay running and are requeued on restart
+            update_queue_item(self.crawl_id, self.website_id, test_name,
+                              QUEUE_DONE if status == "success" else QUEUE_FAILED, status)
+        with self.lock:
+            self.statuses[test_name] = status
+        self.advance()
+
+    def _on_test_done(self, future):
+        shared = future.test_name in self.owned
+        if future.cancelled():
+            # Retry cancelled by a shutdown: the test stays running in the queue and is requeued on restart
+            tests_queued.dec(test=future.test_name)
+            return
+        if isinstance(future.exception(), DeadlineExceeded):
+            tests_queued.dec(test=future.test_name)
+            if shared:
+                shared_targets.complete(self.url, future.test_name, exception=future.exception())
+            self._defer(future.test_name)
+            return
+        result = get_test_result(future)
+        if result.get("status") == "fail" and self._retry(future.test_name, result):
+            return
+        result["target_url"] = self.url
+        if shared:
+            shared_targets.complete(self.url, future.test_name, result)
+        self._complete(future.test_name, result)
+
+    def _on_shared_done(self, test_name, owner, shared):
+        """
+        Store the result of a test run by another entity with the same target URL, with its provenance.
+        """
+        if isinstance(shared.exception(), DeadlineExceeded):
+            self._defer(test_name)
+            return
+        self._complete(test_name, dict(shared.result(), shared_from=owner))
+
+def fail_queue_items(crawl_id, queued_items, error):
     """
-    For a given website, schedule its tests as independent tasks in the global test executor.
-    Returns immediately after scheduling.
+    Mark the unfinished queue items of a website that cannot be crawled as failed.
+    """
+    for item in queued_items or []:
+        if item["state"] in (QUEUE_PENDING, QUEUE_RUNNING):
+            update_queue_item(crawl_id, item["website_id"], item["test_name"], QUEUE_FAILED, error)
+
+def skip_website(website, crawl_id, queued_items, leased, error):
+    """
+    Record a website that cannot be crawled as a failed crawl, so that it is not due (nor leased)
+    again until its recheck backoff expires, and release its lease.
+    """
+    fail_queue_items(crawl_id, queued_items, error)
+    record_crawl_outcome(website["_id"], {}, website.get("consecutive_failures", 0), "skipped")
+    if leased:
+        release_lease(website["_id"])
+
+def spawn_crawl_script(website, crawl_id, test_executor, leased=False, queued_items=None):
+    """
+    For a given website, schedule its tests in the global test executor following TEST_DEPENDENCIES.
+    Returns immediately: a full crawl first probes the website on the probe executor (see probe_site).
+    With queued_items (the test queue of the crawl) only the unfinished tests are run.
+    A leased website (distributed mode) is released when its plan is done or cannot start.
     """
     # If shutdown has been requested, do not schedule new tests.
     if shutdown_event.is_set():
         logger.info("Shutdown event detected. Skipping scheduling of new tests.")
         return
 
-    # We'll use a consistent document per website & crawl.
-    run_timestamp = datetime.now()
-    test_names = ["test_dns", "test_http", "test_ssl", "test_bootstrapitalia", "test_react_bootstrapitalia"]
-    test_names = ["test_dns", "test_http", "test_ssl", "test_bootstrapitalia", "test_lighthouse",  "test_react_bootstrapitalia"]
-
-
     url = website.get("url")
-    name = website.get("name") or website.get("_id", "Unknown")
     if not url:
         logger.error(f"Website ID {website['_id']} ({url}) is missing a URL. Skipping tests.")
+        skip_website(website, crawl_id, queued_items, leased, "Missing URL")
         return
 
     try:
         normalized_url = normalize_url(url)
     except ValueError as e:
         logger.error(f"Error normalizing URL for website ID {website['_id']} ({url}): {e}")
+        skip_website(website, crawl_id, queued_items, leased, "Invalid URL")
+        return
+
+    if queued_items:
+        # Items added when a recheck was extended to the full suite are queued in full mode
+        mode = "full" if any(item.get("mode") == "full" for item in queued_items) else "recheck"
+    else:
+        mode = "recheck" if is_chronic_failure(website) else "full"
+    cached_url = website.get("canonical_url")
+    if mode == "recheck":
+        logger.info(f"Website {normalized_url} failed {website.get('consecutive_failures')} consecutive crawls. Running recheck only.")
+        start_site_plan(website, crawl_id, test_executor, cached_url or normalized_url, mode, leased, queued_items)
         return
 
-    logger.info(f"Starting crawl for website: {normalized_url} ({url})")
+    # The probe counts as a plan until the test plan is started, so that main() waits for it
+    plan_started()
+    future = probe_executor.submit(probe_site, website, url, cached_url)
+    future.add_done_callback(
+        lambda f: finish_probe(f, website, crawl_id, test_executor, normalized_url, leased, queued_items)
+    )
 
-    # Schedule each test as an independent task in the test_executor.
-    for test_name in test_names:
-        if check_existing_test(website["_id"], test_name, crawl_id):
-            continue
-        future = test_executor.submit(run_test_script, normalized_url, test_name, name)
-        # Attach metadata to the future for later use.
-        future.website_id = website["_id"]
-        future.test_name = test_name
-        future.run_timestamp = run_timestamp
-        future.add_done_callback(lambda fut, cid=crawl_id: handle_test_result(fut, cid))
+def probe_site(website, url, cached_url):
+    """
+    Probe the scheme / www. variants of a website once (the cached URL first), then fingerprint the
+    working one with conditional requests on the homepage and its assets (see change_probe.py).
+    Returns (canonical URL or None, True if unchanged since the last audit, fingerprint or None).
+    """
+    with tracer.span("resolve_url", "probe", site=website["_id"]):
+        canonical_url = shared_targets.resolve(url, cached_url)
+    if canonical_url and canonical_url != cached_url:
+        with mongo_write_duration.time(operation="cache_canonical_url"):
+            websites_collection.update_one({"_id": website["_id"]}, {"$set": {"canonical_url": canonical_url}})
+    if not canonical_url:
+        return None, False, None
+    with tracer.span("revalidate", "probe", site=website["_id"]):
+        same, site_fingerprint = unchanged(canonical_url, website.get("fingerprint"))
+    return canonical_url, same, site_fingerprint
 
-def handle_test_result(future, crawl_id):
+def finish_probe(future, website, crawl_id, test_executor, normalized_url, leased, queued_items):
     """
-    Callback to handle an individual test result and store it.
+    Done-callback of probe_site: carry the last audit of an unchanged website forward,
+    otherwise run every test on the working URL.
     """
     try:
-        result = future.result()
+        try:
+            canonical_url, same, site_fingerprint = future.result()
+        except Exception as e:
+            logger.error(f"Error probing website ID {website['_id']} ({normalized_url}): {e}")
+            canonical_url, same, site_fingerprint = None, False, None
+        if shutdown_event.is_set():
+            return
+        if same and carry_forward(website, crawl_id, queued_items, site_fingerprint):
+            if leased:
+                release_lease(website["_id"])
+            return
+        start_site_plan(website, crawl_id, test_executor, canonical_url or normalized_url, "full", leased,
+                        queued_items, site_fingerprint)
+    finally:
+        plan_finished()
+
+def start_site_plan(website, crawl_id, test_executor, target_url, mode, leased, queued_items, fingerprint=None):
+    """
+    Create the test plan of a website on target_url and submit its first tests.
+    """
+    logger.info(f"Starting crawl for website: {target_url} ({website.get('url')})")
+    name = website.get("name") or website.get("_id", "Unknown")
+
+    if queued_items:
+        existing_tests = {item["test_name"]: item["status"] for item in queued_items
+                          if item["state"] in (QUEUE_DONE, QUEUE_FAILED)}
+        attempts = {item["test_name"]: item["attempts"] + 1 for item in queued_items
+                    if item["state"] == QUEUE_PENDING and item.get("attempts")}
+    else:
+        existing_tests = fetch_existing_tests(website["_id"], crawl_id)
+        attempts = None
+    plan = SiteTestPlan(website["_id"], target_url, name, crawl_id, test_executor, existing_tests,
+                        mode=mode, consecutive_failures=website.get("consecutive_failures", 0), leased=leased,
+                        attempts=attempts, fingerprint=fingerprint)
+    plan.advance()
+
+def carry_forward(website, crawl_id, queued_items, fingerprint):
+    """
+    Copy the results of the last full audit of an unchanged website to this crawl, marked as revalidated.
+    Returns False (and nothing is stored) if there is no audit younger than MAX_CARRY_FORWARD whose tests
+    all succeeded: a failed test (e.g. a browser test that timed out) is run again rather than carried.
+    Tests without a script in TESTS_DIR always fail the same way and are carried as they are.
+    """
+    last_audit = website.get("last_audit")
+    if last_audit is None or datetime.now() - last_audit >= MAX_CARRY_FORWARD:
+        return False
+    audit_crawl = website.get("last_audit_crawl")
+    previous = results_collection.find_one({"website_id": website["_id"], "crawl_id": audit_crawl})
+    tests = {t.get("test_name"): t for t in (previous or {}).get("tests", [])}
+    if any(test_name not in tests for test_name in TEST_DEPENDENCIES):
+        return False
+    if any(tests[test_name].get("status") != "success" for test_name in TEST_DEPENDENCIES if has_test_script(test_name)):
+        return False
+
+    logger.info(f"Website {website.get('url')} unchanged since crawl {audit_crawl}; carrying its results forward.")
+    websites_revalidated.inc()
+    carried = [dict(test, revalidated=True, carried_from=audit_crawl) for test in tests.values()]
+    store_crawl_result(website["_id"], crawl_id, carried)
+    for item in queued_items or []:
+        if item["state"] in (QUEUE_PENDING, QUEUE_RUNNING):
+            status = tests[item["test_name"]].get("status")
+            update_queue_item(crawl_id, website["_id"], item["test_name"],
+                              QUEUE_DONE if status == "success" else QUEUE_FAILED, status)
+    statuses = {test_name: test.get("status") for test_name, test in tests.items()}
+    record_crawl_outcome(website["_id"], statuses, website.get("consecutive_failures", 0), "revalidated",
+                         crawl_id, fingerprint)
+    append_dataset_result(website["_id"], crawl_id)
+    return True
+
+def record_crawl_outcome(website_id, statuses, consecutive_failures, mode, crawl_id=None, fingerprint=None):
+    """
+    Update the failure history of a website once all its tests for this crawl are done.
+    Unreachable websites get an exponentially growing next_check; reachable ones are reset.
+    A reachable website also keeps its fingerprint, and a full crawl is recorded as its last audit.
+    """
+    if shutdown_event.is_set():
+        logger.info("Shutdown event detected. Skipping crawl outcome update.")
+        return
+
+    now = datetime.now()
+    fields = {"last_crawl": now, "last_crawl_mode": mode, "priority": 0}
+    if all(statuses.get(t) == "success" for t in RECHECK_TESTS):
+        fields.update({"consecutive_failures": 0, "last_success": now, "next_check": None})
+        if fingerprint is not None:
+            fields["fingerprint"] = fingerprint
+            if mode == "full":
+                fields.update({"last_audit": now, "last_audit_crawl": crawl_id})
+    else:
+        failures = consecutive_failures + 1
+        next_check = now + backoff_delay(failures, RECHECK_BASE_INTERVAL, RECHECK_MAX_INTERVAL)
+        fields.update({"consecutive_failures": failures, "last_failure": now, "next_check": next_check})
+        logger.info(f"Website_id={website_id} unreachable ({failures} consecutive failures). Next check at {next_check}.")
+    with mongo_write_duration.time(operation="record_crawl_outcome"), \
+            tracer.span("record_crawl_outcome", "mongo", site=website_id):
+        websites_collection.update_one({"_id": website_id}, {"$set": fields})
+
+def append_dataset_result(website_id, crawl_id):
+    """
+    Append the completed crawl result of a website to the Parquet results dataset.
+    """
+    if results_writer is None or shutdown_event.is_set():
+        return
+    doc = results_collection.find_one({"website_id": website_id, "crawl_id": crawl_id})
+    website = websites_collection.find_one({"_id": website_id}, {"Codice_IPA": 1, "url": 1})
+    if doc is None or website is None:
+        return
+    with tracer.span("append_dataset_result", "parquet", site=website_id):
+        results_writer.append(row_from_crawl_result(website, doc))
+
+def get_test_result(future):
+    """
+    Return the result of a test future, turning an exception into a failed result.
+    """
+    try:
+        return future.result()
     except Exception as e:
         logger.exception("Error in test callback: %s", e)
-        result = {
+        return {
             "test_name": getattr(future, "test_name", "unknown"),
             "status": "fail",
             "error": str(e),
             "execution_timestamp": datetime.now()
         }
-    website_id = getattr(future, "website_id", None)
-    if website_id is not None:
-        store_crawl_result(website_id, crawl_id, [result])
+
+def plan_started():
+    global active_plans
+    with plans_condition:
+        active_plans += 1
+
+def plan_finished():
+    global active_plans
+    with plans_condition:
+        active_plans -= 1
+        plans_condition.notify_all()
+
+def wait_for_plans():
+    """
+    Wait until every started test plan is finished (including retries), or a shutdown is requested.
+    """
+    with plans_condition:
+        while active_plans > 0 and not shutdown_event.is_set():
+            plans_condition.wait(timeout=1)
 
 def store_crawl_result(website_id, crawl_id, new_tests):
     """
@@ -308,27 +1172,32 @@ def store_crawl_result(website_id, crawl_id, new_tests):
         return
 
     logger.info(f"Storing results for website_id={website_id}, crawl_id={crawl_id}")
-    existing_run = results_collection.find_one({
-        "website_id": website_id,
-        "crawl_id": crawl_id
-    })
+    with tracer.span("find_crawl_result", "mongo", site=website_id):
+        existing_run = results_collection.find_one({
+            "website_id": website_id,
+            "crawl_id": crawl_id
+        })
 
     if existing_run:
         existing_tests = existing_run.get("tests", [])
         for new_test in new_tests:
             if not any(test.get("test_name") == new_test.get("test_name") for test in existing_tests):
                 existing_tests.append(new_test)
-        results_collection.update_one(
-            {"_id": existing_run["_id"]},
-            {"$set": {"tests": existing_tests}}
-        )
+        with mongo_write_duration.time(operation="update_crawl_result"), \
+                tracer.span("update_crawl_result", "mongo", site=website_id):
+            results_collection.update_one(
+                {"_id": existing_run["_id"]},
+                {"$set": {"tests": existing_tests}}
+            )
         logger.debug(f"Updated existing crawl result for website_id={website_id}")
     else:
-        results_collection.insert_one({
-            "website_id": website_id,
-            "crawl_id": crawl_id,
-            "tests": new_tests
-        })
+        with mongo_write_duration.time(operation="insert_crawl_result"), \
+                tracer.span("insert_crawl_result", "mongo", site=website_id):
+            results_collection.insert_one({
+                "website_id": website_id,
+                "crawl_id": crawl_id,
+                "tests": new_tests
+            })
         logger.debug(f"Inserted new crawl result for website_id={website_id}")
 
 def ensure_indexes():
@@ -337,16 +1206,25 @@ def ensure_indexes():
     """
     logger.info("Ensuring MongoDB indexes...")
     websites_collection.create_index([("last_crawl", pymongo.ASCENDING)])
+    websites_collection.create_index([("next_check", pymongo.ASCENDING)])
+    websites_collection.create_index([("priority", pymongo.DESCENDING), ("last_crawl", pymongo.ASCENDING)])
+    websites_collection.create_index([("lease_owner", pymongo.ASCENDING)])
     results_collection.create_index([("crawl_id", pymongo.ASCENDING)])
+    queue_collection.create_index(
+        [("crawl_id", pymongo.ASCENDING), ("website_id", pymongo.ASCENDING), ("test_name", pymongo.ASCENDING)],
+        unique=True
+    )
+    queue_collection.create_index([("crawl_id", pymongo.ASCENDING), ("state", pymongo.ASCENDING)])
     logger.info("Indexes created successfully.")
 
 # Bounded submission for website tasks using a semaphore to limit queued tasks.
 website_semaphore = threading.Semaphore(MAX_QUEUE_SIZE)
 def bounded_submit(executor, fn, *args, **kwargs):
     website_semaphore.acquire()
+    websites_queued.inc()
     future = executor.submit(fn, *args, **kwargs)
     # Release semaphore when the task is done.
-    future.add_done_callback(lambda f: website_semaphore.release())
+    future.add_done_callback(lambda f: (websites_queued.dec(), website_semaphore.release()))
     return future
 
 def main():
@@ -358,40 +1236,128 @@ def main():
     """
     parser = argparse.ArgumentParser(description="Website Crawler")
     parser.add_argument("--crawl_id", required=True, help="Unique identifier for this crawl")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help=f"Local port serving /metrics and /metrics.json (default: {METRICS_PORT}, 0 disables it)")
+    parser.add_argument("--metrics-dump", default=None,
+                        help="JSON file where metrics are dumped at shutdown (default: logs/metrics_<crawl_id>.json)")
+    parser.add_argument("--results-dataset", default=RESULTS_DATASET_DIR,
+                        help=f"Parquet dataset where completed results are appended (default: {RESULTS_DATASET_DIR}, empty disables it)")
+    parser.add_argument("--timeseries", default=TIMESERIES_DIR,
+                        help=f"Per-entity change log updated from the dataset at shutdown (default: {TIMESERIES_DIR}, empty disables it)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-phase spans for each site and test in a Chrome trace file")
+    parser.add_argument("--profile-output", default=None,
+                        help="Trace file written at shutdown (default: logs/trace_<crawl_id>.json)")
+    parser.add_argument("--distributed", action="store_true",
+                        help="Lease websites from MongoDB so that several crawler nodes can share the crawl")
+    parser.add_argument("--zygote", action="store_true",
+                        help="Fork tests from a process with the test modules already imported instead of starting python3 each time")
+    parser.add_argument("--no-sandbox", action="store_true",
+                        help="Run browser tests without the cgroup v2 limits of SANDBOX_LIMITS")
+    parser.add_argument("--sample", type=float, default=None, metavar="MARGIN",
+                        help="Crawl first a stratified sample of the registry sized for this margin of error "
+                             "(e.g. 0.03) and write its sampling weights, then the rest of the crawl")
+    parser.add_argument("--registry", default=REGISTRY_FILE, help=f"Registry stratified by --sample (default: {REGISTRY_FILE})")
+    parser.add_argument("--deadline", type=float, default=None, metavar="MINUTES",
+                        help="Time budget of the crawl: cheap tests run first for every website and the tests "
+                             "not started in time stay pending for a resumed crawl")
     args = parser.parse_args()
     crawl_id = args.crawl_id
+    metrics_dump = args.metrics_dump or os.path.join("logs", f"metrics_{crawl_id}.json")
+    profile_output = args.profile_output or os.path.join("logs", f"trace_{crawl_id}.json")
+    tracer.enabled = args.profile
+    global results_writer
+    if args.results_dataset:
+        results_writer = ResultsWriter(datetime.now().date(), args.results_dataset)
 
     logger.info(f"Starting crawler with crawl_id={crawl_id}...")
+    global sandbox_enabled
+    if not args.no_sandbox:
+        try:
+            setup_cgroup_parent()
+            sandbox_enabled = True
+            logger.info(f"Browser tests run in cgroup v2 sandboxes under {SANDBOX_CGROUP}.")
+        except OSError as e:
+            logger.warning(f"cgroup v2 sandboxes unavailable ({e}); browser tests run unconfined.")
+    global zygote
+    if args.zygote:
+        try:
+            zygote = ZygoteClient(tests_dir=TESTS_DIR)
+            logger.info("Tests are forked from a zygote with preloaded modules.")
+        except OSError as e:
+            logger.warning(f"Cannot start the zygote ({e}); tests start a new interpreter.")
+    if args.metrics_port:
+        try:
+            metrics.serve(args.metrics_port)
+            logger.info(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+        except OSError as e:
+            # Another crawler on this host (e.g. a second distributed node) may already hold the port
+            logger.warning(f"Cannot serve metrics on port {args.metrics_port} ({e}); continuing without the endpoint.")
 
-    # Global executor for test tasks limited to MAX_CONCURRENT_TESTS.
-    test_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TESTS)
+    # Global scheduler for test tasks limited to MAX_CONCURRENT_TESTS, with one lane per test type.
+    deadline = time.time() + args.deadline * 60 if args.deadline else None
+    if deadline:
+        logger.info(f"Deadline mode: tests not started by {datetime.fromtimestamp(deadline)} are deferred.")
+    test_executor = LaneScheduler(MAX_CONCURRENT_TESTS, TEST_LANES, deadline)
+    global retry_lane, probe_executor
+    retry_lane = RetryLane(test_executor.submit)
+    probe_executor = ThreadPoolExecutor(max_workers=MAX_PROBE_WORKERS, thread_name_prefix="probe")
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as website_executor:
         try:
-            # Resume any incomplete tests from a previous crawl.
-            incomplete_tests = fetch_incomplete_tests(crawl_id)
-            if incomplete_tests:
-                logger.info("Resuming incomplete tests from previous crawl...")
-                for test in incomplete_tests:
-                    if shutdown_event.is_set():
-                        logger.info("Shutdown event detected. Exiting resume loop.")
+            if args.distributed:
+                logger.info(f"Distributed mode: leasing websites as node {NODE_ID}.")
+                threading.Thread(target=heartbeat_leases, name="lease-heartbeat", daemon=True).start()
+                for website in lease_websites(crawl_id):
+                    if test_executor.expired():
+                        release_lease(website["_id"])
+                        logger.info("Crawl deadline reached. Not leasing more websites.")
                         break
-                    bounded_submit(website_executor, spawn_crawl_script, test, crawl_id, test_executor)
+                    bounded_submit(website_executor, spawn_crawl_script, website, crawl_id, test_executor, leased=True)
+                return
 
-            # Process websites in batches.
-            for batch in fetch_websites_to_crawl(batch_size=100):
+            # Create the test queue of the crawl once, then run (or resume) its unfinished tests.
+            if args.sample:
+                plan_sample(crawl_id, args.sample, args.registry)
+            plan_crawl(crawl_id)
+            for website, items in fetch_queued_websites(crawl_id):
                 if shutdown_event.is_set():
-                    logger.info("Shutdown event detected. Breaking out of website batch loop.")
+                    logger.info("Shutdown event detected. Skipping scheduling new website tasks.")
                     break
-                for website in batch:
-                    if shutdown_event.is_set():
-                        logger.info("Shutdown event detected. Skipping scheduling new website tasks.")
-                        break
-                    bounded_submit(website_executor, spawn_crawl_script, website, crawl_id, test_executor)
+                if test_executor.expired():
+                    logger.info("Crawl deadline reached. Remaining websites stay pending in the test queue.")
+                    break
+                bounded_submit(website_executor, spawn_crawl_script, website, crawl_id, test_executor,
+                               queued_items=items)
         except KeyboardInterrupt:
             logger.warning("KeyboardInterrupt detected. Exiting gracefully.")
         finally:
             website_executor.shutdown(wait=True)
+            # Dependent tests and retries are submitted as tests finish: wait for the plans first
+            wait_for_plans()
+            probe_executor.shutdown(wait=True)
+            retry_lane.shutdown()
             test_executor.shutdown(wait=True)
+            if zygote is not None:
+                zygote.close()
+            if args.distributed:
+                # Unfinished websites go back to the queue right away instead of waiting for expiry
+                heartbeat_stop.set()
+                websites_collection.update_many(
+                    {"lease_owner": NODE_ID}, {"$set": {"lease_owner": None, "lease_expires": None}}
+                )
+            if results_writer is not None:
+                results_writer.close()
+                if args.timeseries and not shutdown_event.is_set():
+                    try:
+                        ingest_timeseries(results_writer.crawl_date, args.results_dataset, args.timeseries)
+                    except Exception as e:
+                        logger.exception(f"Error updating the change log {args.timeseries}: {e}")
+            metrics.dump_json(metrics_dump)
+            metrics.shutdown()
+            logger.info(f"Metrics dumped to {metrics_dump}")
+            if tracer.enabled:
+                tracer.write(profile_output)
+                logger.info(f"Trace written to {profile_output}\n{tracer.summary()}")
             client.close()
             logger.info("MongoDB connection closed.")
             logger.info("Crawler shutdown complete.")
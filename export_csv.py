@@ -1,9 +1,10 @@
 import csv
 from pymongo import MongoClient
 import argparse
-from datetime import datetime
+from datetime import date, datetime
+from results_store import ResultsWriter, row_from_crawl_result
 
-def extract_data(crawl_id, output_file="output.csv"):
+def extract_data(crawl_id, output_file="output.csv", dataset_dir=None, crawl_date=None):
     # Connect to MongoDB (adjust connection string and database name as needed)
     client = MongoClient("mongodb://localhost:27017")
     db = client["website_crawler"]
@@ -13,6 +14,7 @@ def extract_data(crawl_id, output_file="output.csv"):
     # Query crawl_results based on the provided crawl_id
     crawl_docs = crawl_results_col.find({"crawl_id": crawl_id})
     rows = []
+    dataset_writer = ResultsWriter(crawl_date or date.today(), dataset_dir) if dataset_dir else None
     
     # These test names will be handled in a fixed way and skipped in dynamic processing
     fixed_test_names = {"test_lighthouse", "test_bootstrapitalia"}
@@ -24,6 +26,9 @@ def extract_data(crawl_id, output_file="output.csv"):
         if not website:
             continue
 
+        if dataset_writer is not None:
+            dataset_writer.append(row_from_crawl_result(website, doc))
+
         row = {}
 
         # Fixed field: Codice_IPA from the website document.
@@ -94,6 +99,9 @@ def extract_data(crawl_id, output_file="output.csv"):
             writer.writerow(row)
 
     print(f"Data extracted to {output_file}")
+    if dataset_writer is not None:
+        dataset_writer.close()
+        print(f"Data appended to the Parquet dataset {dataset_dir}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -101,6 +109,10 @@ if __name__ == "__main__":
     )
     parser.add_argument("crawl_id", type=str, help="The crawl_id to filter crawl_results")
     parser.add_argument("--output", type=str, default="output.csv", help="Output CSV file name")
+    parser.add_argument("--parquet-dir", type=str, default=None,
+                        help="Also append the results to this partitioned Parquet dataset (e.g. results_dataset)")
+    parser.add_argument("--crawl-date", type=date.fromisoformat, default=None,
+                        help="Partition date for --parquet-dir (default: today)")
     args = parser.parse_args()
 
-    extract_data(args.crawl_id, args.output)
+    extract_data(args.crawl_id, args.output, args.parquet_dir, args.crawl_date)
@@ -1,4 +1,8 @@
 #! /bin/bash
 
-echo "Codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia,bootstrap2_js,bootstrap2_css" > entiRes.csv
-find entiRes -name \*.json -exec ./gatherResEnte.sh '{}' \; | tee -a entiRes.csv
+# Reads entiRes/*.json in a single process, writes entiRes.csv and appends
+# the results to the Parquet dataset (results_dataset/crawlDate=<today>),
+# then records the per-entity changes in the change log (results_timeseries).
+crawl_date=${CRAWL_DATE:-$(date +%F)}
+python3 results_store.py gather entiRes --csv entiRes.csv --crawl-date "${crawl_date}" "$@"
+python3 timeseries.py ingest --crawl-date "${crawl_date}"
@@ -1,10 +1,51 @@
+import atexit
+import json
 import logging
 import os
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+MAX_MESSAGE_LENGTH = 4096           # Longer messages (e.g. test stderr) are truncated
+LOG_MAX_BYTES = 50 * 1024 * 1024    # Rotate the log file when it reaches this size
+LOG_BACKUP_COUNT = 5                # Number of rotated log files to keep
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    Queue handler that formats the message on the caller's thread,
+    truncates oversized payloads and leaves all I/O to the listener thread.
+    """
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if len(record.msg) > MAX_MESSAGE_LENGTH:
+            dropped = len(record.msg) - MAX_MESSAGE_LENGTH
+            record.msg = f"{record.msg[:MAX_MESSAGE_LENGTH]}... [truncated {dropped} chars]"
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        return json.dumps({
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
+
 
 def setup_logger(name):
     """
-    Configures a logger with a standard format and file handler.
-    
+    Configures a logger with a JSON lines rotating file handler and a console handler.
+    Records are put on a queue and written by a single background listener thread,
+    so logging calls never block on file I/O.
+
     Args:
         name (str): Name of the logger.
 
@@ -16,24 +57,30 @@ def setup_logger(name):
 
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)  # Set global logging level (DEBUG, INFO, WARNING, etc.)
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
 
-    # Formatter for logs
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    # Rotating file handler with structured JSON lines
+    file_handler = RotatingFileHandler(
+        f"{log_dir}/{name}.log", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
     )
-
-    # File Handler
-    file_handler = logging.FileHandler(f"{log_dir}/{name}.log")
     file_handler.setLevel(logging.DEBUG)  # Log everything to file
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(JsonFormatter())
 
     # Console Handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)  # Show INFO+ messages on console
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+
+    # Both handlers are driven by a single background listener
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(TruncatingQueueHandler(log_queue))
+    logger.propagate = False
 
     return logger
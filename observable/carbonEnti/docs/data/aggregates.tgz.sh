@@ -0,0 +1,90 @@
+#! /bin/bash
+
+# Precomputed aggregate tables for the analysis pages, so that the browser does not
+# download the full per-entity entiRes table on first paint. Each table is a small
+# Parquet file of the archive, e.g. FileAttachment("data/aggregates/counts.parquet").
+
+tmpdir=$(mktemp -d)
+entiRes=${tmpdir}/entiRes.parquet
+
+bash ./docs/data/entiRes.parquet.sh > "${entiRes}"
+
+duckdb -c "SET preserve_insertion_order=false; \
+CREATE VIEW E AS SELECT ER.*, P.Regione, \
+CASE WHEN (ER.lighthouseScore = 0 OR ER.lighthouseScore IS NULL) THEN 'KO' ELSE 'OK' END AS LightHouseRun, \
+(NULLIF(ER.bootstrap2_css, '') IS NOT NULL OR NULLIF(ER.bootstrap2_js, '') IS NOT NULL) AS usesBootstrapItalia \
+FROM read_parquet('${entiRes}') ER \
+LEFT JOIN read_csv_auto('./docs/data/province.csv') P ON TRY_CAST(ER.Codice_comune_ISTAT AS INTEGER) // 1000 = P.COD_PROV; \
+\
+COPY (SELECT crawlDate, Codice_Categoria, Codice_natura, Nome_categoria, Tipologia_categoria, Regione, LightHouseRun, \
+COUNT(Codice_IPA) AS countEnti, \
+SUM(CASE WHEN bootstrap IS TRUE THEN 1 ELSE 0 END)::INTEGER AS countBootstrap, \
+SUM(CASE WHEN bootstrapItalia IS TRUE THEN 1 ELSE 0 END)::INTEGER AS countBootstrapItalia, \
+SUM(CASE WHEN usesBootstrapItalia THEN 1 ELSE 0 END)::INTEGER AS countBootstrapItaliaVersion \
+FROM E GROUP BY ALL) TO '${tmpdir}/counts.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD'); \
+\
+COPY (SELECT crawlDate, Tipologia_categoria, Regione, metric, bin, binWidth, COUNT(*) AS countEnti FROM ( \
+SELECT crawlDate, Tipologia_categoria, Regione, 'lighthouseScore' AS metric, floor(lighthouseScore / 2) * 2 AS bin, 2 AS binWidth FROM E WHERE lighthouseScore > 0 \
+UNION ALL SELECT crawlDate, Tipologia_categoria, Regione, 'firstMeaningfulPaint', floor(firstMeaningfulPaint / 250) * 250, 250 FROM E WHERE lighthouseScore > 0 AND firstMeaningfulPaint < 9000 \
+UNION ALL SELECT crawlDate, Tipologia_categoria, Regione, 'totalByteWeight', floor(totalByteWeight / 250000) * 250000, 250000 FROM E WHERE lighthouseScore > 0 AND totalByteWeight < 10e6 \
+) GROUP BY ALL) TO '${tmpdir}/histograms.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD'); \
+\
+CREATE VIEW M AS \
+SELECT crawlDate, 'firstMeaningfulPaint' AS metric, firstMeaningfulPaint AS value FROM E WHERE lighthouseScore > 0 AND firstMeaningfulPaint IS NOT NULL \
+UNION ALL SELECT crawlDate, 'firstMeaningfulPaint<9000', firstMeaningfulPaint FROM E WHERE lighthouseScore > 0 AND firstMeaningfulPaint < 9000 \
+UNION ALL SELECT crawlDate, 'totalByteWeight', totalByteWeight FROM E WHERE lighthouseScore > 0 AND totalByteWeight IS NOT NULL \
+UNION ALL SELECT crawlDate, 'totalByteWeight<10e6', totalByteWeight FROM E WHERE lighthouseScore > 0 AND totalByteWeight < 10e6; \
+COPY (WITH Q AS (SELECT crawlDate, metric, quantile_cont(value, 0.25) AS q1, median(value) AS median, quantile_cont(value, 0.75) AS q3 FROM M GROUP BY ALL) \
+SELECT Q.crawlDate, Q.metric, Q.q1, Q.median, Q.q3, \
+min(M.value) FILTER (WHERE M.value >= Q.q1 - 1.5 * (Q.q3 - Q.q1)) AS lo, \
+max(M.value) FILTER (WHERE M.value <= Q.q3 + 1.5 * (Q.q3 - Q.q1)) AS hi \
+FROM Q JOIN M ON Q.crawlDate = M.crawlDate AND Q.metric = M.metric GROUP BY ALL) \
+TO '${tmpdir}/boxplots.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD'); \
+\
+COPY (SELECT crawlDate, Nome_categoria, Tipologia_categoria, Regione, 'css' AS kind, bootstrap2_css AS version, COUNT(Codice_IPA) AS countEnti \
+FROM E WHERE lighthouseScore > 0 AND NULLIF(bootstrap2_css, '') IS NOT NULL GROUP BY ALL \
+UNION ALL SELECT crawlDate, Nome_categoria, Tipologia_categoria, Regione, 'js', bootstrap2_js, COUNT(Codice_IPA) \
+FROM E WHERE lighthouseScore > 0 AND NULLIF(bootstrap2_js, '') IS NOT NULL GROUP BY ALL) \
+TO '${tmpdir}/bootstrapVersions.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD'); \
+\
+COPY (SELECT crawlDate, Codice_comune_ISTAT, \
+CASE WHEN Codice_Categoria = 'L6' AND Codice_natura = '2430' THEN 'comuni' ELSE 'scuole' END AS gruppo, \
+NULLIF(bootstrap2_css, '') AS bootstrap2_css, COUNT(Codice_IPA) AS countEnti, \
+SUM(CASE WHEN usesBootstrapItalia THEN 1 ELSE 0 END)::INTEGER AS countBootstrap \
+FROM E WHERE (Codice_Categoria = 'L6' AND Codice_natura = '2430') OR Codice_Categoria = 'L33' GROUP BY ALL) \
+TO '${tmpdir}/comuniBootstrap.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD')" >&2
+
+# Stratified estimates with 95% confidence intervals for the crawls started with
+# crawler.py --sample, from the sampling weights in sampling_weights/crawlId=<crawl_id>.csv.
+# A crawl can span several crawl dates: it is reported at the last one.
+# Only Bootstrap Italia is estimated: the crawler does not run Lighthouse. Sampled entities
+# without a result of test_bootstrapitalia shrink their stratum (N_h * m_h / n_h).
+weights=${SAMPLING_WEIGHTS:-../../sampling_weights}
+if ls "${weights}"/crawlId=*.csv > /dev/null 2>&1; then
+	duckdb -c "SET preserve_insertion_order=false; \
+CREATE VIEW E AS SELECT * FROM read_parquet('${entiRes}'); \
+CREATE VIEW W AS SELECT regexp_extract(filename, 'crawlId=(.*)\.csv$', 1) AS crawl_id, * EXCLUDE (filename) \
+FROM read_csv_auto('${weights}/crawlId=*.csv', filename=true, types={'Codice_IPA': 'VARCHAR'}); \
+CREATE VIEW S AS SELECT max(E.crawlDate) OVER (PARTITION BY W.crawl_id) AS crawlDate, W.stratum, W.population, W.sampled, \
+E.* EXCLUDE (crawlDate) FROM W JOIN E ON E.Codice_IPA = W.Codice_IPA AND E.crawl_id = W.crawl_id \
+QUALIFY row_number() OVER (PARTITION BY W.crawl_id, W.Codice_IPA ORDER BY E.crawlDate DESC) = 1; \
+CREATE VIEW Y AS \
+SELECT crawl_id, crawlDate, stratum, population, sampled, Tipologia_categoria, 'usesBootstrapItalia' AS metric, CASE WHEN bootstrapItalia THEN 1.0 ELSE 0.0 END AS y \
+FROM S WHERE bootstrapItalia IS NOT NULL; \
+CREATE VIEW H AS SELECT crawl_id, crawlDate, COALESCE(Tipologia_categoria, 'Totale') AS domain, metric, stratum, \
+any_value(population) * COUNT(*) / any_value(sampled) AS N, COUNT(*) AS m, avg(y) AS ybar, COALESCE(var_samp(y), 0) AS s2 \
+FROM Y GROUP BY GROUPING SETS ((crawl_id, crawlDate, Tipologia_categoria, metric, stratum), (crawl_id, crawlDate, metric, stratum)); \
+COPY (SELECT crawl_id, crawlDate, domain, metric, SUM(m)::INTEGER AS sampleSize, SUM(N) AS population, \
+SUM(N * ybar) / SUM(N) AS estimate, \
+sqrt(SUM(N * N * GREATEST(1 - m / N, 0) * s2 / m)) / SUM(N) AS standardError, \
+estimate - 1.96 * standardError AS lo, estimate + 1.96 * standardError AS hi \
+FROM H GROUP BY ALL) TO '${tmpdir}/estimates.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD')" >&2
+else
+	duckdb -c "COPY (SELECT NULL::VARCHAR AS crawl_id, NULL::VARCHAR AS crawlDate, NULL::VARCHAR AS domain, NULL::VARCHAR AS metric, NULL::INTEGER AS sampleSize, \
+NULL::DOUBLE AS population, NULL::DOUBLE AS estimate, NULL::DOUBLE AS standardError, NULL::DOUBLE AS lo, NULL::DOUBLE AS hi \
+WHERE false) TO '${tmpdir}/estimates.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD')" >&2
+fi
+
+rm "${entiRes}"
+cd "${tmpdir}" && tar -czf - *.parquet
+rm -rf "${tmpdir}"
@@ -0,0 +1,34 @@
+#! /bin/bash
+
+# Municipality boundaries as quantized TopoJSON at several simplification levels,
+# e.g. FileAttachment("data/comuniGeo/low.json"). Each feature carries only its
+# Codice_comune_ISTAT (the ISTAT PRO_COM_T code), which is also the feature id,
+# so pages join it directly with the entiRes tables.
+#   low.json    national static maps (Plot.geo)
+#   medium.json Leaflet maps at regional zoom
+#   high.json   Leaflet maps zoomed in on a few provinces
+
+shapefile=./docs/data/Limiti01012024_g/Com01012024_g/Com01012024_g_WGS84.shp
+
+tmpdir=$(mktemp -d)
+
+# Pinned and fetched by npx on demand, so that it is not part of package-lock.json
+mapshaper=mapshaper@0.6.102
+
+simplify() {
+    npx --yes "${mapshaper}" -i "${shapefile}" \
+        -proj wgs84 \
+        -rename-fields Codice_comune_ISTAT=PRO_COM_T \
+        -filter-fields Codice_comune_ISTAT \
+        -simplify "$1" weighted keep-shapes \
+        -rename-layers comuni \
+        -o "${tmpdir}/$2.json" format=topojson id-field=Codice_comune_ISTAT quantization="$3"
+}
+
+simplify 1% low 1e4
+simplify 5% medium 1e5
+simplify 20% high 1e5
+
+tar -czf - -C "${tmpdir}" low.json medium.json high.json
+
+rm -rf "${tmpdir}"
@@ -1,46 +1,138 @@
 #! /bin/bash
 
-filename=/tmp/entiRes.parquet
-filename2=/tmp/entiResIPA.parquet
-
-
-url_2022_02_11=https://raw.githubusercontent.com/mfortini/carbonEnti/172024cc177ff57455460a9235b9fb4f96d32f2d/entiRes.csv
-url_2023_11_02=https://raw.githubusercontent.com/mfortini/carbonEnti/ce5141b5f3b2db53bb50c7e08fd48a90468f9642/entiRes.csv
-url_2024_03_12=https://raw.githubusercontent.com/mfortini/carbonEnti/98aec540827cbe1cc1684c8552d89d591e81c38a/entiRes.csv
-url_2024_07_31=https://raw.githubusercontent.com/mfortini/carbonEnti/2923492daadf776b3de0fd78bc75f0cea6900433/entiRes.csv
-url_2025_02_20=https://raw.githubusercontent.com/mfortini/carbonEnti/1d85262afa8a89265963f7fd7d5caf9d493d8a2e/entiRes.csv
-
-url_IPA=https://raw.githubusercontent.com/mfortini/carbonEnti/main/enti.csv
-url_categorieIPA=https://raw.githubusercontent.com/mfortini/carbonEnti/main/entiCategorie.csv
-url_entiCheck=https://raw.githubusercontent.com/mfortini/carbonEnti/main/entiCheck.csv
-url_CurlExitStatuses=https://raw.githubusercontent.com/mfortini/carbonEnti/main/CurlExitStatuses.csv
-
-duckdb -c "SET preserve_insertion_order=false;\
-COPY (SELECT CAST ('2022-02-11' AS DATE) AS crawlDate,codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia, NULL AS bootstrap2_js, NULL AS bootstrap2_css FROM read_csv_auto('${url_2022_02_11}') \
-UNION SELECT CAST ('2023-11-02' AS DATE) AS crawlDate,codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia, NULL AS bootstrap2_js, NULL AS bootstrap2_css FROM read_csv_auto('${url_2023_11_02}') \
-UNION SELECT CAST ('2024-03-12' AS DATE) AS crawlDate,codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia, NULL AS bootstrap2_js, NULL AS bootstrap2_css FROM read_csv_auto('${url_2024_03_12}') \
-UNION SELECT CAST ('2024-07-31' AS DATE) AS crawlDate,codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia, bootstrap2_js, regexp_extract(bootstrap2_css, '\"(.*)\"',1) as bootstrap2_css FROM read_csv_auto('${url_2024_07_31}') \
-UNION SELECT CAST ('2025-02-20' AS DATE) AS crawlDate, codice_IPA,url,lighthouseScore,firstMeaningfulPaint,totalByteWeight,bootstrap,bootstrapItalia, bootstrap2_js, bootstrap2_css FROM read_csv_auto('${url_2025_02_20}') \
-) TO '${filename}' (FORMAT 'PARQUET',CODEC 'ZSTD')"
-
-duckdb -c "SET preserve_insertion_order=false; \
-COPY (SELECT CAST (ER.crawlDate AS STRING) as crawlDate,\
-ER.Codice_IPA, ER.url, ER.lightHouseScore,\
-ER.firstMeaningfulPaint, ER.totalByteWeight, \
-ER.bootstrap, ER.bootstrapItalia, ER.bootstrap2_js, \
-ER.bootstrap2_css, \
+# Reads the local Parquet results dataset (hive-partitioned by crawlDate) written by
+# the crawler, export_csv.py --parquet-dir and gatherRes.sh, and joins it with IndicePA.
+#
+# The loader is incremental: every crawl is materialized once in ${store}/crawls, already
+# joined with the IndicePA dimensions, and rebuilt only when its partition files change.
+# The dimension join (${store}/dims.parquet) is rebuilt only when one of its CSVs changes.
+
+root=../..
+dataset=${RESULTS_DATASET:-${root}/results_dataset}
+store=${ENTIRES_STORE:-.entiRes_store}
+# Per-run output, so that entiRes.parquet and aggregates.tgz can be built at the same time
+filename=$(mktemp --suffix=.parquet)
+trap 'rm -f "${filename}"' EXIT
+
+# Historical crawls published as entiRes.csv, imported once into the dataset
+declare -A historical=(
+	[2022-02-11]=https://raw.githubusercontent.com/mfortini/carbonEnti/172024cc177ff57455460a9235b9fb4f96d32f2d/entiRes.csv
+	[2023-11-02]=https://raw.githubusercontent.com/mfortini/carbonEnti/ce5141b5f3b2db53bb50c7e08fd48a90468f9642/entiRes.csv
+	[2024-03-12]=https://raw.githubusercontent.com/mfortini/carbonEnti/98aec540827cbe1cc1684c8552d89d591e81c38a/entiRes.csv
+	[2024-07-31]=https://raw.githubusercontent.com/mfortini/carbonEnti/2923492daadf776b3de0fd78bc75f0cea6900433/entiRes.csv
+	[2025-02-20]=https://raw.githubusercontent.com/mfortini/carbonEnti/1d85262afa8a89265963f7fd7d5caf9d493d8a2e/entiRes.csv
+)
+
+mkdir -p "${store}/csv" "${store}/crawls"
+
+# Concurrent builds update the store one at a time
+exec 9> "${store}/.lock"
+flock 9
+
+# Use the local copy of a CSV if present, otherwise download it (only if newer than the cached copy)
+csv_or_url() {
+	if [ -f "$1" ]; then
+		echo "$1"
+		return
+	fi
+	local cached="${store}/csv/$(basename "$1")"
+	if [ -f "${cached}" ]; then
+		curl -s -f -z "${cached}" -o "${cached}" "$2"
+	else
+		curl -s -f -o "${cached}" "$2"
+	fi
+	echo "${cached}"
+}
+
+url_IPA=$(csv_or_url ${root}/enti.csv https://raw.githubusercontent.com/mfortini/carbonEnti/main/enti.csv)
+url_categorieIPA=$(csv_or_url ${root}/entiCategorie.csv https://raw.githubusercontent.com/mfortini/carbonEnti/main/entiCategorie.csv)
+url_entiCheck=$(csv_or_url ${root}/entiCheck.csv https://raw.githubusercontent.com/mfortini/carbonEnti/main/entiCheck.csv)
+url_CurlExitStatuses=$(csv_or_url ${root}/CurlExitStatuses.csv https://raw.githubusercontent.com/mfortini/carbonEnti/main/CurlExitStatuses.csv)
+
+mkdir -p "${dataset}"
+
+for crawlDate in "${!historical[@]}"; do
+	partition="${dataset}/crawlDate=${crawlDate}"
+	if [ ! -d "${partition}" ]; then
+		# bootstrap2_* columns exist only since the 2024-07-31 crawl
+		if [[ "${crawlDate}" < "2024-07-31" ]]; then
+			bootstrap2="NULL::VARCHAR AS bootstrap2_js, NULL::VARCHAR AS bootstrap2_css"
+		else
+			bootstrap2="NULLIF(trim(CAST(bootstrap2_js AS VARCHAR), '\"'), '') AS bootstrap2_js, \
+NULLIF(trim(CAST(bootstrap2_css AS VARCHAR), '\"'), '') AS bootstrap2_css"
+		fi
+		# Imported into a temporary directory, moved into place only once complete
+		staging=$(mktemp -d "${dataset}/.import-XXXXXX")
+		duckdb -c "COPY (SELECT CAST(codice_IPA AS VARCHAR) AS Codice_IPA, NULL::TIMESTAMP AS ts, CAST(url AS VARCHAR) AS url, \
+TRY_CAST(lighthouseScore AS DOUBLE) AS lighthouseScore, TRY_CAST(firstMeaningfulPaint AS DOUBLE) AS firstMeaningfulPaint, \
+TRY_CAST(totalByteWeight AS DOUBLE) AS totalByteWeight, TRY_CAST(bootstrap AS BOOLEAN) AS bootstrap, \
+TRY_CAST(bootstrapItalia AS BOOLEAN) AS bootstrapItalia, ${bootstrap2} \
+FROM read_csv_auto('${historical[$crawlDate]}')) \
+TO '${staging}/part-historical.parquet' (FORMAT 'PARQUET', CODEC 'ZSTD')" >&2 \
+			&& mv "${staging}" "${partition}"
+		rm -rf "${staging}"
+	fi
+done
+
+# Dimension join, rebuilt only when one of its CSVs changed
+dims_signature=$(cat "${url_IPA}" "${url_categorieIPA}" "${url_entiCheck}" "${url_CurlExitStatuses}" | md5sum | cut -d' ' -f1)
+if [ "$(cat "${store}/dims.sig" 2>/dev/null)" != "${dims_signature}" ]; then
+	duckdb -c "SET preserve_insertion_order=false; \
+COPY (SELECT IPA.Codice_IPA, \
 IPA.Denominazione_ente, IPA.Codice_comune_ISTAT, IPA.Tipologia, \
 IPA.Codice_Categoria, IPA.Codice_natura, \
 cIPA.Nome_categoria, cIPA.Tipologia_categoria, \
 IPA.Codice_ateco, \
 entiCheck.HTTPCode, \
 CurlExitStatuses.Description as CurlExitStatus \
-FROM read_parquet('${filename}') ER \
-JOIN read_csv_auto('${url_IPA}', strict_mode=false) IPA ON ER.Codice_IPA = IPA.Codice_IPA \
+FROM read_csv_auto('${url_IPA}', strict_mode=false) IPA \
 JOIN read_csv_auto('${url_categorieIPA}', strict_mode=false) cIPA ON IPA.Codice_Categoria = cIPA.Codice_categoria \
-JOIN read_csv_auto('${url_entiCheck}', strict_mode=false) entiCheck ON ER.Codice_IPA=entiCheck.Codice_IPA \
+JOIN read_csv_auto('${url_entiCheck}', strict_mode=false) entiCheck ON IPA.Codice_IPA=entiCheck.Codice_IPA \
 LEFT JOIN read_csv_auto('${url_CurlExitStatuses}', strict_mode=false) CurlExitStatuses ON entiCheck.CurlExitStatus=CurlExitStatuses.CurlExitStatus ) \
-TO '${filename2}' (FORMAT 'PARQUET',CODEC 'ZSTD')"
+TO '${store}/dims.parquet' (FORMAT 'PARQUET',CODEC 'ZSTD')" >&2 \
+	&& echo "${dims_signature}" > "${store}/dims.sig"
+fi
+
+# Columns of the materialized crawls; bump to rebuild them when the columns change
+crawls_version=2
+
+# Materialize the crawls not seen before, or whose partition files or dimensions changed
+for partition in "${dataset}"/crawlDate=*; do
+	crawlDate=${partition##*crawlDate=}
+	target="${store}/crawls/crawlDate=${crawlDate}.parquet"
+	signature=$( (echo "${crawls_version} ${dims_signature}"; ls -l --time-style=+%s "${partition}") | md5sum | cut -d' ' -f1)
+	if [ -f "${target}" ] && [ "$(cat "${target}.sig" 2>/dev/null)" == "${signature}" ]; then
+		continue
+	fi
+	# crawl_id (the key of the sampling weights) exists only in the partitions written by the crawler
+	if [ "$(duckdb -noheader -list -c "SELECT count(*) FROM parquet_schema('${partition}/*.parquet') WHERE name = 'crawl_id'")" != "0" ]; then
+		crawl_id="ER.crawl_id"
+	else
+		crawl_id="NULL::VARCHAR AS crawl_id"
+	fi
+	duckdb -c "SET preserve_insertion_order=false; \
+COPY (SELECT '${crawlDate}' as crawlDate, ${crawl_id},\
+ER.Codice_IPA, ER.url, CAST(ER.lightHouseScore AS DOUBLE) AS lightHouseScore,\
+CAST(ER.firstMeaningfulPaint AS DOUBLE) AS firstMeaningfulPaint, CAST(ER.totalByteWeight AS DOUBLE) AS totalByteWeight, \
+ER.bootstrap, ER.bootstrapItalia, ER.bootstrap2_js, \
+ER.bootstrap2_css, \
+D.* EXCLUDE (Codice_IPA) \
+FROM (SELECT * FROM read_parquet('${partition}/*.parquet', union_by_name=true) \
+QUALIFY row_number() OVER (PARTITION BY Codice_IPA ORDER BY ts DESC NULLS LAST) = 1) ER \
+JOIN read_parquet('${store}/dims.parquet') D ON ER.Codice_IPA = D.Codice_IPA) \
+TO '${target}' (FORMAT 'PARQUET',CODEC 'ZSTD')" >&2 \
+	&& echo "${signature}" > "${target}.sig"
+done
+
+# Drop crawls whose partition no longer exists
+for target in "${store}"/crawls/crawlDate=*.parquet; do
+	crawlDate=$(basename "${target}" .parquet)
+	if [ ! -d "${dataset}/${crawlDate}" ]; then
+		rm -f "${target}" "${target}.sig"
+	fi
+done
+
+duckdb -c "COPY (SELECT * FROM read_parquet('${store}/crawls/*.parquet', union_by_name=true)) \
+TO '${filename}' (FORMAT 'PARQUET',CODEC 'ZSTD')"
 
-cat "${filename2}"
-rm "${filename}" "${filename2}"
+cat "${filename}"
@@ -0,0 +1,42 @@
+import random
+from array import array
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+
+SHUFFLE_BUFFER = 5000   # Items held by shuffled() at a time; each block costs a pass over the source
+
+
+def shuffled(source, buffer_size=SHUFFLE_BUFFER, rng=random):
+    """
+    Yield the items of source() in a uniformly random order holding at most buffer_size of them.
+
+    Only a compact index is shuffled: a first pass counts the items, the permutation of their
+    positions is split in blocks of buffer_size and each block is filled by a new pass.
+
+    Args:
+        source (callable): Returns a fresh iterable over the same items in the same order,
+            e.g. lambda: iter_registry(path, filters).
+    """
+    order = array("L", range(sum(1 for _ in source())))
+    rng.shuffle(order)
+    for start in range(0, len(order), buffer_size):
+        slots = {position: slot for slot, position in enumerate(order[start:start + buffer_size])}
+        block = [None] * len(slots)
+        for position, item in enumerate(source()):
+            slot = slots.get(position)
+            if slot is not None:
+                block[slot] = item
+        yield from block
+
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """
+    Submit fn(item) for each item while keeping at most max_in_flight futures pending,
+    so that items are consumed lazily. Yields the futures as they complete.
+    """
+    pending = set()
+    for item in items:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+        pending.add(executor.submit(fn, item))
+    yield from as_completed(pending)
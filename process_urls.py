@@ -1,16 +1,24 @@
 import argparse
 import yaml
-import pandas as pd
 import os
 import json
 import logging
 from pathlib import Path
 from datetime import datetime
-from multiprocessing.pool import ThreadPool
+from backoff import backoff_delay
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import run
 
+from change_probe import fingerprint, revalidate
+from profiler import Tracer
+from planner import bounded_map, shuffled
+from registry import iter_registry
+
 logging.basicConfig(level=logging.DEBUG)
 
+# Per-phase spans, enabled with --profile
+tracer = Tracer(enabled=False)
+
 def usage():
     print("Usage")
     print("crawl -c config.yaml")
@@ -18,39 +26,74 @@ def usage():
 def parseArguments():
     parser = argparse.ArgumentParser(description="Process some integers.")
     parser.add_argument("-c", "--config", type=str, help="config file")
+    parser.add_argument("--profile", action="store_true", help="record per-phase spans for each site")
+    parser.add_argument("--profile-output", type=str, default="trace_process_urls.json", help="trace file (Chrome trace format)")
 
     args = parser.parse_args()
 
     return args
 
 def crawlEnte(ente, outputDir, cfg):
-    logging.info("crawlEnte {}".format(ente["Denominazione_ente"]))
+    with tracer.span("crawlEnte", "site", site=ente.Codice_IPA):
+        doCrawlEnte(ente, outputDir, cfg)
+
+def doCrawlEnte(ente, outputDir, cfg):
+    logging.info("crawlEnte {}".format(ente.Denominazione_ente))
     tsNow = datetime.now().timestamp()
-    codiceIPA = ente["Codice_IPA"]
+    codiceIPA = ente.Codice_IPA
     rerun = True
+    failures = 0
+    canonicalUrl = None
     output_file = os.path.join(outputDir, codiceIPA + ".json")
     with open(output_file, "a+") as f:
         try:
             f.seek(0)
             existData = json.load(f)
             ts = existData["ts"]
+            failures = existData.get("consecutiveFailures", 0)
+            canonicalUrl = existData.get("canonicalUrl")
+            if existData.get("sitoIstituzionale") != ente.Sito_istituzionale:
+                # Registry URL changed (or not recorded by older runs): the cached URL may be of another site
+                canonicalUrl = None
+            ttl = max(cfg["TTL"], backoff_delay(failures, cfg["TTL"], cfg.get("maxBackoff", cfg["TTL"])))
             logging.info(
-                "tsNow {} ts {} diff {} TTL {}".format(
-                    tsNow, ts, tsNow - ts, cfg["TTL"]
+                "tsNow {} ts {} diff {} TTL {} failures {}".format(
+                    tsNow, ts, tsNow - ts, ttl, failures
                 )
             )
-            if (tsNow - ts) < cfg["TTL"]:
+            if (tsNow - ts) < ttl:
                 rerun = False
+            elif cfg.get("maxCarryForward"):
+                # Unchanged homepage and assets: keep the last audit instead of running Lighthouse again
+                with tracer.span("revalidate", "probe", site=codiceIPA):
+                    carried = revalidate(existData, canonicalUrl, tsNow, cfg["maxCarryForward"])
+                if carried is not None:
+                    rerun = False
+                    f.seek(0)
+                    f.truncate(0)
+                    json.dump(carried, f)
         except json.JSONDecodeError:
             logging.warning("Cannot decode JSON")
             pass
 
         if rerun:
-            url = ente["Sito_istituzionale"]
+            url = ente.Sito_istituzionale
             logging.info("Rerun {}".format(url))
             result_file = os.path.join(outputDir, f"{codiceIPA}_result.json")
-            run(["python", "analyze_url.py", url, "-o", result_file])
-
+            command = ["python", "analyze_url.py", url, "-o", result_file]
+            if canonicalUrl:
+                # Working URL found by the previous run, probed before the other variants
+                command += ["--canonical-url", canonicalUrl]
+            trace_file = os.path.join(outputDir, f"{codiceIPA}_trace.json")
+            if tracer.enabled:
+                command += ["--profile-output", trace_file]
+            with tracer.span("analyze_url", "process", site=codiceIPA):
+                run(command)
+            if tracer.enabled:
+                tracer.merge(trace_file, site=codiceIPA)
+                Path(trace_file).unlink(missing_ok=True)
+
+            res = None
             try:
                 with open(result_file, "r") as rf:
                     res = json.load(rf)
@@ -62,30 +105,40 @@ def crawlEnte(ente, outputDir, cfg):
 
             Path(result_file).unlink(missing_ok=True)
 
+            # Keep track of consecutive failures so that the TTL backs off for unreachable sites
+            if res is None or not res.get("lighthouseScore"):
+                if res is None:
+                    res = {"Codice_IPA": codiceIPA, "ts": tsNow, "url": url, "lighthouseScore": 0}
+                res["consecutiveFailures"] = failures + 1
+            else:
+                res["consecutiveFailures"] = 0
+                if cfg.get("maxCarryForward") and res.get("canonicalUrl"):
+                    # Fingerprint of the audited site, compared by the next revalidation
+                    with tracer.span("fingerprint", "probe", site=codiceIPA):
+                        res["fingerprint"] = fingerprint(res["canonicalUrl"])
+                    res["auditTs"] = tsNow
+                    res["revalidated"] = False
+
             if res is not None:
+                res["sitoIstituzionale"] = url
                 print(res)
-                f.seek(0)
-                f.truncate(0)
-                json.dump(res, f)
+                with tracer.span("write_result", "io", site=codiceIPA):
+                    f.seek(0)
+                    f.truncate(0)
+                    json.dump(res, f)
 
 def main():
     args = parseArguments()
+    tracer.enabled = args.profile
 
     with open(args.config, "r") as f:
         cfg = yaml.safe_load(f)
 
     logging.info(cfg)
 
-    crawlList = pd.read_csv(cfg["list"])
-
-    # Filtra solo i comuni
-    if False:
-        entiList = crawlList[crawlList["Codice_natura"] == 2430]
-    else:
-        entiList = crawlList
-
-    # Randomize list
-    entiList = entiList.sample(frac=1).reset_index(drop=True)
+    # Tutti gli enti, salvo filtri in crawl.yaml (es. filters: {Codice_natura: [2430]}),
+    # letti a blocchi e in ordine casuale senza caricare tutto il registro
+    enti = shuffled(lambda: iter_registry(cfg["list"], cfg.get("filters")))
 
     outputDir = cfg["outputDir"]
 
@@ -94,13 +147,16 @@ def main():
     except OSError:
         pass
 
-    tp = ThreadPool()
-    for idx, ente in entiList.iterrows():
-        tp.apply_async(crawlEnte, (ente, outputDir, cfg))
-        #crawlEnte(ente,outputDir,cfg)
+    workers = cfg.get("workers", os.cpu_count())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        crawl = lambda ente: crawlEnte(ente, outputDir, cfg)
+        for future in bounded_map(executor, crawl, enti, 2 * workers):
+            if future.exception() is not None:
+                logging.error("crawlEnte failed: {}".format(future.exception()))
 
-    tp.close()
-    tp.join()
+    if tracer.enabled:
+        tracer.write(args.profile_output)
+        logging.info("Trace written to {}\n{}".format(args.profile_output, tracer.summary()))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+class Tracer:
+    """
+    Records wall-time spans per pipeline phase and site, and writes them in the
+    Chrome trace event format (open with chrome://tracing or https://ui.perfetto.dev).
+    A disabled tracer records nothing, so spans can be left in the hot path.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def span(self, name, category, site=None, **args):
+        """
+        Context manager recording the wall time of the block as a span.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = _now_us()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, _now_us() - start, site=site, **args)
+
+    def add_span(self, name, category, start_us, duration_us, site=None, **args):
+        """
+        Record a span that started at start_us (microseconds since the epoch).
+        """
+        if not self.enabled:
+            return
+        if site is not None:
+            args["site"] = str(site)
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_us,
+            "dur": duration_us,
+            "pid": self.pid,
+            "tid": threading.get_native_id(),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def merge(self, path, site=None):
+        """
+        Merge the spans written by a child process (see write) into this trace.
+        """
+        if not self.enabled:
+            return
+        try:
+            with open(path, "r") as f:
+                events = json.load(f).get("traceEvents", [])
+        except (OSError, json.JSONDecodeError):
+            return
+        for event in events:
+            if site is not None:
+                args = event.setdefault("args", {})
+                if "site" in args:
+                    args.setdefault("url", args["site"])
+                args["site"] = str(site)
+        with self.lock:
+            self.events.extend(events)
+
+    def write(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, top_n=10):
+        """
+        Return a text report of the phases and sites with the most wall time.
+        """
+        with self.lock:
+            events = [e for e in self.events if e.get("ph") == "X"]
+
+        phases = defaultdict(lambda: [0, 0, 0])  # name -> [count, total, max]
+        site_spans = defaultdict(int)  # sites with an enclosing "site" span
+        site_work = defaultdict(int)   # otherwise, the sum of their phases
+        for event in events:
+            phase = phases[f"{event['cat']}/{event['name']}"]
+            phase[0] += 1
+            phase[1] += event["dur"]
+            phase[2] = max(phase[2], event["dur"])
+            site = event.get("args", {}).get("site")
+            if site is None:
+                continue
+            if event["cat"] == "site":
+                site_spans[site] += event["dur"]
+            elif event["cat"] != "queue_wait":
+                site_work[site] += event["dur"]
+        sites = site_spans or site_work
+
+        lines = [f"Top {top_n} phases by total wall time:"]
+        for name, (count, total, longest) in sorted(phases.items(), key=lambda x: -x[1][1])[:top_n]:
+            lines.append(
+                f"  {name}: total={total / 1e6:.2f}s count={count} "
+                f"mean={total / count / 1e6:.2f}s max={longest / 1e6:.2f}s"
+            )
+        lines.append(f"Top {top_n} sites by total wall time:")
+        for site, total in sorted(sites.items(), key=lambda x: -x[1])[:top_n]:
+            lines.append(f"  {site}: {total / 1e6:.2f}s")
+        lines.append(f"Top {top_n} slowest spans:")
+        for event in sorted(events, key=lambda e: -e["dur"])[:top_n]:
+            lines.append(
+                f"  {event['cat']}/{event['name']} {event.get('args', {}).get('site', '')}: {event['dur'] / 1e6:.2f}s"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,127 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+
+PUBLISH_DIR = "published"
+
+# Fields that change at every crawl without a real change of the site: kept only in entiRes/
+VOLATILE_FIELDS = {"ts", "consecutiveFailures", "lighthouseRawResult", "rawResult", "resource-summary",
+                   "fingerprint", "auditTs", "revalidated"}
+
+# Measurements are rounded so that run-to-run noise does not count as a change
+ROUNDING = {
+    "lighthouseScore": 0.01,
+    "firstMeaningfulPaint": 100,  # ms
+    "totalByteWeight": 1024,      # bytes
+    "accessibility": 0.01,
+}
+
+
+def _get(data, *path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _round(value, step):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return value
+    rounded = round(value / step) * step
+    return int(rounded) if step >= 1 else round(rounded, 6)
+
+
+def normalize(data):
+    """
+    Build the canonical record of an entiRes/<Codice_IPA>.json file, without volatile fields.
+    """
+    record = {
+        "Codice_IPA": data.get("Codice_IPA"),
+        "url": data.get("url"),
+        "lighthouseScore": data.get("lighthouseScore"),
+        "firstMeaningfulPaint": _get(data, "first-meaningful-paint", "numericValue"),
+        "totalByteWeight": _get(data, "total-byte-weight", "numericValue"),
+        "accessibility": data.get("accessibility"),
+        "bootstrapItalia": data.get("bootstrapItalia"),
+        "bootstrapItalia2": data.get("bootstrapItalia2"),
+    }
+    # Keep any field added to the crawler output later on
+    for key, value in data.items():
+        if key not in VOLATILE_FIELDS and key not in record and key not in ("first-meaningful-paint", "total-byte-weight"):
+            record[key] = value
+    for key, step in ROUNDING.items():
+        record[key] = _round(record.get(key), step)
+    return record
+
+
+def canonical_json(record):
+    return json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def publish(results_dir, publish_dir=PUBLISH_DIR):
+    """
+    Write the canonical record of every entity whose content changed since the last run
+    and append the changes to the changelog of the day. Returns the number of changes.
+    """
+    records_dir = os.path.join(publish_dir, "records")
+    changelog_dir = os.path.join(publish_dir, "changelog")
+    os.makedirs(records_dir, exist_ok=True)
+    os.makedirs(changelog_dir, exist_ok=True)
+
+    now = datetime.now()
+    changes = []
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))):
+        codice_ipa = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path, "r") as f:
+                record = normalize(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        seen.add(codice_ipa)
+
+        content = canonical_json(record)
+        record_path = os.path.join(records_dir, f"{codice_ipa}.json")
+        try:
+            with open(record_path, "r") as f:
+                previous = f.read()
+        except FileNotFoundError:
+            previous = None
+        if previous == content:
+            continue
+
+        with open(record_path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(record_path + ".tmp", record_path)
+        changes.append({
+            "Codice_IPA": codice_ipa,
+            "change": "added" if previous is None else "updated",
+            "sha256": hashlib.sha256(content.encode()).hexdigest(),
+            "record": record,
+        })
+
+    for record_path in sorted(glob.glob(os.path.join(records_dir, "*.json"))):
+        codice_ipa = os.path.splitext(os.path.basename(record_path))[0]
+        if codice_ipa not in seen:
+            os.remove(record_path)
+            changes.append({"Codice_IPA": codice_ipa, "change": "removed"})
+
+    if changes:
+        with open(os.path.join(changelog_dir, f"{now.date().isoformat()}.jsonl"), "a") as f:
+            for change in changes:
+                f.write(json.dumps({"ts": now.isoformat(timespec="seconds"), **change}, sort_keys=True, ensure_ascii=False) + "\n")
+    print(f"Published {len(changes)} changed records out of {len(seen)}")
+    return len(changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish only the entiRes records whose content changed.")
+    parser.add_argument("results_dir", nargs="?", default="entiRes")
+    parser.add_argument("--output", default=PUBLISH_DIR, help=f"Published directory (default: {PUBLISH_DIR})")
+    args = parser.parse_args()
+    publish(args.results_dir, args.output)
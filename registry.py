@@ -0,0 +1,81 @@
+import pandas as pd
+
+# Map of province code -> region, used by the "Regione" filter
+PROVINCE_FILE = "observable/carbonEnti/docs/data/province.csv"
+
+CHUNK_SIZE = 5000   # Rows read at a time by iter_registry
+
+# Columns of the IndicePA dump used by the crawlers, with compact dtypes
+COLUMNS = {
+    "Codice_IPA": "string",
+    "Denominazione_ente": "string",
+    "Sito_istituzionale": "string",
+    "Codice_natura": "category",
+    "Codice_Categoria": "category",
+    "Codice_comune_ISTAT": "string",
+}
+
+
+class Ente:
+    """
+    Lightweight record of a registry row, cheap to pass to worker threads.
+    """
+
+    __slots__ = tuple(COLUMNS)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, None if pd.isna(value) else value)
+
+    def __repr__(self):
+        return f"Ente({self.Codice_IPA!r}, {self.Sito_istituzionale!r})"
+
+
+def load_regions(province_file=PROVINCE_FILE):
+    """
+    Return {province code: region} from province.csv.
+    """
+    province = pd.read_csv(province_file, dtype={"COD_PROV": "int32", "Regione": "string"})
+    return dict(zip(province["COD_PROV"], province["Regione"]))
+
+
+def _apply_filters(df, filters, regions):
+    for column, values in (filters or {}).items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        values = [str(v) for v in values]
+        if column == "Regione":
+            province = pd.to_numeric(df["Codice_comune_ISTAT"], errors="coerce") // 1000
+            df = df[province.map(regions).isin(values)]
+        elif column in COLUMNS:
+            df = df[df[column].astype("string").isin(values)]
+        else:
+            raise ValueError(f"Unknown registry filter column: {column}")
+    return df
+
+
+def iter_registry(path, filters=None, province_file=PROVINCE_FILE, chunksize=CHUNK_SIZE):
+    """
+    Yield the Ente records of the registry matching filters, reading chunksize rows at a time
+    so that memory does not grow with the size of the registry.
+
+    Args:
+        path (str): Path or URL of enti.csv.
+        filters (dict): Column -> allowed value or list of values, e.g. from crawl.yaml:
+            {"Codice_natura": [2430], "Codice_Categoria": ["L6"], "Regione": ["Lombardia"]}.
+            Columns are combined with AND, values of a column with OR.
+    """
+    regions = load_regions(province_file) if "Regione" in (filters or {}) else None
+    with pd.read_csv(path, usecols=list(COLUMNS), dtype=COLUMNS, encoding="utf-8-sig", chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = _apply_filters(chunk, filters, regions)
+            # usecols keeps the file order, Ente expects the COLUMNS order
+            for row in chunk[list(COLUMNS)].itertuples(index=False, name=None):
+                yield Ente(*row)
+
+
+def load_registry(path, filters=None, province_file=PROVINCE_FILE):
+    """
+    Read only the needed columns of the registry and return a list of Ente records (see iter_registry).
+    """
+    return list(iter_registry(path, filters, province_file))
@@ -0,0 +1,233 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+# IndicePA dump of all public administrations
+REGISTRY_URL = "https://indicepa.gov.it/ipa-dati/datastore/dump/d09adf99-dc10-4349-8c53-27b1e5aa97b6?bom=True"
+REGISTRY_FILE = "enti.csv"
+INDEX_FILE = "registry_index.json"      # Codice_IPA -> [row hash, Sito_istituzionale] of the last sync
+MONGO_INDEX_FILE = "registry_index_mongo.json"  # Same, for the last sync of the websites collection
+CHANGES_FILE = "registry_changes.json"  # Entities to crawl first, read by crawl.py
+DOWNLOAD_TIMEOUT = 300
+REMOVED_RETENTION = timedelta(days=90)  # Removed entities are listed in the changes file for this long
+
+
+def fetch_registry(url=REGISTRY_URL, path=REGISTRY_FILE):
+    """
+    Download the registry with a conditional request (ETag / Last-Modified stored in <path>.meta.json).
+    Returns True if a new version was downloaded, False if the local copy is up to date.
+    """
+    meta_path = path + ".meta.json"
+    meta = {}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+    request = urllib.request.Request(url)
+    if meta.get("etag"):
+        request.add_header("If-None-Match", meta["etag"])
+    if meta.get("last_modified"):
+        request.add_header("If-Modified-Since", meta["last_modified"])
+
+    try:
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            with open(path + ".tmp", "wb") as f:
+                while chunk := response.read(1 << 20):
+                    f.write(chunk)
+            meta = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            print(f"{path} is up to date")
+            return False
+        raise
+
+    os.replace(path + ".tmp", path)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    print(f"Downloaded {url} to {path}")
+    return True
+
+
+def build_index(path=REGISTRY_FILE):
+    """
+    Return {Codice_IPA: [sha1 of the row, Sito_istituzionale]} for the registry CSV.
+    """
+    index = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        codice_col = header.index("Codice_IPA")
+        url_col = header.index("Sito_istituzionale")
+        for row in reader:
+            if len(row) <= max(codice_col, url_col):
+                continue
+            digest = hashlib.sha1("\x1f".join(row).encode()).hexdigest()
+            index[row[codice_col]] = [digest, row[url_col]]
+    return index
+
+
+def diff_index(old, new):
+    """
+    Return the Codice_IPA added, removed, with a changed Sito_istituzionale and with other changed fields.
+    """
+    added = sorted(new.keys() - old.keys())
+    removed = sorted(old.keys() - new.keys())
+    common = old.keys() & new.keys()
+    url_changed = sorted(k for k in common if old[k][1] != new[k][1])
+    changed = sorted(k for k in common if old[k][0] != new[k][0] and old[k][1] == new[k][1])
+    return {"added": added, "removed": removed, "url_changed": url_changed, "changed": changed}
+
+
+def load_changes(path=CHANGES_FILE):
+    """
+    Return the pending changes: {"priority": {Codice_IPA: {"reason", "detected"}}, "removed": {Codice_IPA: detected}}.
+    """
+    try:
+        with open(path, "r") as f:
+            changes = json.load(f)
+    except FileNotFoundError:
+        return {"priority": {}, "removed": {}}
+    if isinstance(changes.get("removed"), list):
+        # Written before removals were timestamped: they expire from now
+        detected = datetime.now().timestamp()
+        changes["removed"] = {codice_ipa: detected for codice_ipa in changes["removed"]}
+    return changes
+
+
+def save_changes(changes, path=CHANGES_FILE):
+    with open(path + ".tmp", "w") as f:
+        json.dump(changes, f)
+    os.replace(path + ".tmp", path)
+
+
+def record_changes(diff, path=CHANGES_FILE):
+    """
+    Merge a registry diff into the pending changes file.
+    Added entities and changed URLs are crawled first; crawl.py forces a new crawl of an entity
+    whose result is older than its detection time, then drops it (see prune_changes).
+    Removed entities are kept for REMOVED_RETENTION.
+    """
+    changes = load_changes(path)
+    detected = datetime.now().timestamp()
+    for reason in ("added", "url_changed"):
+        for codice_ipa in diff[reason]:
+            changes["priority"][codice_ipa] = {"reason": reason, "detected": detected}
+    removed = changes["removed"]
+    for codice_ipa in diff["removed"]:
+        removed.setdefault(codice_ipa, detected)
+        changes["priority"].pop(codice_ipa, None)
+    expired = detected - REMOVED_RETENTION.total_seconds()
+    changes["removed"] = {
+        codice_ipa: since for codice_ipa, since in sorted(removed.items())
+        if since >= expired and codice_ipa not in diff["added"]
+    }
+    changes["updated"] = detected
+    save_changes(changes, path)
+
+
+def prune_changes(crawled, path=CHANGES_FILE):
+    """
+    Drop the priority entities crawled since their change was detected.
+    crawled maps Codice_IPA to the timestamp of its stored result (see crawl.py).
+    """
+    changes = load_changes(path)
+    done = [
+        codice_ipa for codice_ipa, change in changes["priority"].items()
+        if crawled.get(codice_ipa) is not None and crawled[codice_ipa] >= change["detected"]
+    ]
+    if not done:
+        return 0
+    for codice_ipa in done:
+        del changes["priority"][codice_ipa]
+    save_changes(changes, path)
+    return len(done)
+
+
+def apply_to_mongo(diff, index, websites_collection):
+    """
+    Apply a registry diff to the websites collection with a single bulk write.
+    Added entities and changed URLs get priority so that the crawler schedules them first.
+    """
+    from pymongo import UpdateOne
+
+    now = datetime.now()
+    operations = []
+    for codice_ipa in diff["added"]:
+        operations.append(UpdateOne(
+            {"Codice_IPA": codice_ipa},
+            {"$set": {"url": index[codice_ipa][1], "priority": 1, "removed_at": None},
+             "$setOnInsert": {"last_crawl": None}},
+            upsert=True,
+        ))
+    for codice_ipa in diff["url_changed"]:
+        operations.append(UpdateOne(
+            {"Codice_IPA": codice_ipa},
+            {"$set": {"url": index[codice_ipa][1], "priority": 1, "next_check": None, "consecutive_failures": 0,
+                      "canonical_url": None}},
+        ))
+    for codice_ipa in diff["removed"]:
+        operations.append(UpdateOne({"Codice_IPA": codice_ipa}, {"$set": {"removed_at": now, "priority": 0}}))
+    if operations:
+        websites_collection.bulk_write(operations, ordered=False)
+
+
+def sync(path=REGISTRY_FILE, index_path=INDEX_FILE, changes_path=CHANGES_FILE, websites_collection=None):
+    """
+    Compare the registry with the index of the last sync and record the differences.
+    On the first sync every entity is added without priority.
+    Each consumer of the diff keeps its own index: a sync consumes the differences from its index,
+    so the changes file (changes_path, None to skip it) and a websites collection synced at different
+    times need different index files.
+    """
+    new_index = build_index(path)
+    first_sync = not os.path.exists(index_path)
+    old_index = {}
+    if not first_sync:
+        with open(index_path, "r") as f:
+            old_index = json.load(f)
+
+    diff = diff_index(old_index, new_index)
+    print(
+        f"Registry sync: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+        f"{len(diff['url_changed'])} URL changed, {len(diff['changed'])} other changes"
+    )
+    if websites_collection is not None:
+        if first_sync:
+            # Existing documents keep their crawl history, new ones are created without priority
+            from pymongo import UpdateOne
+            websites_collection.bulk_write([
+                UpdateOne({"Codice_IPA": k}, {"$set": {"url": v[1]}, "$setOnInsert": {"last_crawl": None}}, upsert=True)
+                for k, v in new_index.items()
+            ], ordered=False)
+        else:
+            apply_to_mongo(diff, new_index, websites_collection)
+    if not first_sync and changes_path is not None:
+        record_changes(diff, changes_path)
+
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(new_index, f)
+    os.replace(index_path + ".tmp", index_path)
+    return diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the IndicePA registry and detect changed entities.")
+    parser.add_argument("--url", default=REGISTRY_URL)
+    parser.add_argument("--output", default=REGISTRY_FILE, help="Local copy of the registry")
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--changes", default=CHANGES_FILE)
+    parser.add_argument("--no-download", action="store_true", help="Diff the local copy without downloading")
+    parser.add_argument("--mongo", default=None, help="Also update the websites collection of this MongoDB URI")
+    args = parser.parse_args()
+
+    if args.no_download or fetch_registry(args.url, args.output) or not os.path.exists(args.index):
+        collection = None
+        if args.mongo:
+            import pymongo
+            collection = pymongo.MongoClient(args.mongo)["website_crawler"]["websites"]
+        sync(args.output, args.index, args.changes, collection)
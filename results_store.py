@@ -0,0 +1,269 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Root of the Parquet dataset, hive-partitioned by crawl date (crawlDate=YYYY-MM-DD/part-*.parquet)
+RESULTS_DATASET_DIR = "results_dataset"
+FLUSH_ROWS = 500  # Rows buffered by ResultsWriter before a part file is written
+
+# Stable typed schema shared by the crawler, export_csv.py and the dashboard loaders
+SCHEMA = pa.schema([
+    ("crawl_id", pa.string()),
+    ("Codice_IPA", pa.string()),
+    ("ts", pa.timestamp("s")),
+    ("url", pa.string()),
+    ("lighthouseScore", pa.float64()),
+    ("firstMeaningfulPaint", pa.float64()),
+    ("totalByteWeight", pa.float64()),
+    ("accessibilityScore", pa.float64()),
+    ("bootstrap", pa.bool_()),
+    ("bootstrapItalia", pa.bool_()),
+    ("bootstrap2_js", pa.string()),
+    ("bootstrap2_css", pa.string()),
+    ("test_dns_status", pa.string()),
+    ("test_http_status", pa.string()),
+    ("test_ssl_status", pa.string()),
+    ("certificate_issuer", pa.string()),
+])
+
+# Columns of the legacy entiRes.csv written by gatherRes.sh
+CSV_COLUMNS = [
+    "Codice_IPA", "url", "lighthouseScore", "firstMeaningfulPaint", "totalByteWeight",
+    "bootstrap", "bootstrapItalia", "bootstrap2_js", "bootstrap2_css"
+]
+
+
+def _float(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _bool(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1")
+    return bool(value)
+
+
+def _str(value):
+    if value is None or value == "":
+        return None
+    # CSS custom properties keep their quotes (e.g. "2.8.3")
+    return str(value).strip().strip('"').strip("'")
+
+
+def _get(data, *path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _issuer(value):
+    """
+    Flatten the issuer returned by ssl.getpeercert() ((("O", "..."),), ...) to "O=..., CN=...".
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        return value
+    try:
+        return ", ".join(f"{k}={v}" for rdn in value for k, v in rdn)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def write_partition(rows, crawl_date, root=RESULTS_DATASET_DIR):
+    """
+    Write rows (dicts following SCHEMA) as a new part file of the crawl_date partition.
+    Returns the path of the written file, or None if there was nothing to write.
+    """
+    if not rows:
+        return None
+    partition_dir = os.path.join(root, f"crawlDate={crawl_date.isoformat()}")
+    os.makedirs(partition_dir, exist_ok=True)
+    table = pa.Table.from_pylist(
+        [{name: row.get(name) for name in SCHEMA.names} for row in rows], schema=SCHEMA
+    )
+    path = os.path.join(partition_dir, f"part-{uuid.uuid4().hex}.parquet")
+    # Write to a temporary name so readers never see a partial file
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class ResultsWriter:
+    """
+    Thread-safe buffered appender to the partitioned results dataset.
+    """
+
+    def __init__(self, crawl_date, root=RESULTS_DATASET_DIR, flush_rows=FLUSH_ROWS):
+        self.crawl_date = crawl_date
+        self.root = root
+        self.flush_rows = flush_rows
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def append(self, row):
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) < self.flush_rows:
+                return
+            rows, self.rows = self.rows, []
+        write_partition(rows, self.crawl_date, self.root)
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        return write_partition(rows, self.crawl_date, self.root)
+
+    def close(self):
+        self.flush()
+
+
+def row_from_crawl_result(website, doc):
+    """
+    Build a dataset row from a website document and its crawl_results document.
+    """
+    tests = {t.get("test_name"): t for t in doc.get("tests", [])}
+    lighthouse = tests.get("test_lighthouse", {})
+    bootstrap = tests.get("test_bootstrapitalia", {})
+    # Bootstrap Italia (which implies Bootstrap) is detected from the version it exposes
+    uses_bootstrap_italia = None
+    if bootstrap.get("status") == "success":
+        uses_bootstrap_italia = bool(bootstrap.get("js_version") or bootstrap.get("css_version"))
+    timestamps = [t.get("execution_timestamp") for t in tests.values() if isinstance(t.get("execution_timestamp"), datetime)]
+    return {
+        "crawl_id": doc.get("crawl_id"),
+        "Codice_IPA": website.get("Codice_IPA"),
+        "ts": max(timestamps) if timestamps else datetime.now(),
+        "url": _str(tests.get("test_ssl", {}).get("url") or website.get("url")),
+        "lighthouseScore": _float(lighthouse.get("lighthouseScore")),
+        "firstMeaningfulPaint": _float(lighthouse.get("largestContentfulPaint")),
+        "totalByteWeight": _float(lighthouse.get("totalByteWeight")),
+        "accessibilityScore": _float(lighthouse.get("accessibilityScore")),
+        "bootstrap": uses_bootstrap_italia,
+        "bootstrapItalia": uses_bootstrap_italia,
+        "bootstrap2_js": _str(bootstrap.get("js_version")),
+        "bootstrap2_css": _str(bootstrap.get("css_version")),
+        "test_dns_status": tests.get("test_dns", {}).get("status"),
+        "test_http_status": tests.get("test_http", {}).get("status"),
+        "test_ssl_status": tests.get("test_ssl", {}).get("status"),
+        "certificate_issuer": _issuer(tests.get("test_ssl", {}).get("certificate_issuer")),
+    }
+
+
+def row_from_entity_json(codice_ipa, data):
+    """
+    Build a dataset row from an entiRes/<Codice_IPA>.json file (same fields as gatherResEnte.sh).
+    """
+    ts = data.get("ts")
+    return {
+        "crawl_id": None,
+        "Codice_IPA": codice_ipa,
+        "ts": datetime.fromtimestamp(float(ts)) if _float(ts) is not None else None,
+        "url": _str(data.get("url")),
+        "lighthouseScore": _float(data.get("lighthouseScore")),
+        "firstMeaningfulPaint": _float(_get(data, "rawResult", "audits", "largest-contentful-paint", "numericValue")),
+        "totalByteWeight": _float(_get(data, "total-byte-weight", "numericValue")),
+        "accessibilityScore": _float(data.get("accessibility")),
+        "bootstrap": _bool(_get(data, "bootstrapItalia", "bootstrap")),
+        "bootstrapItalia": _bool(_get(data, "bootstrapItalia", "bootstrapItalia")),
+        "bootstrap2_js": _str(_get(data, "bootstrapItalia", "bootstrapItaliaVariable")),
+        "bootstrap2_css": _str(_get(data, "bootstrapItalia", "bootstrapItaliaMethod")),
+        "test_dns_status": None,
+        "test_http_status": None,
+        "test_ssl_status": None,
+        "certificate_issuer": None,
+    }
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+
+def gather(results_dir, crawl_date, root=RESULTS_DATASET_DIR, csv_file=None):
+    """
+    Read every entiRes/*.json file in-process and append them to the dataset,
+    optionally writing the legacy entiRes.csv as well.
+    """
+    rows = []
+    for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))):
+        codice_ipa = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path, "r") as f:
+                rows.append(row_from_entity_json(codice_ipa, json.load(f)))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {path}: {e}")
+
+    write_partition(rows, crawl_date, root)
+    if csv_file:
+        with open(csv_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for row in rows:
+                writer.writerow([_csv_value(row[c]) for c in CSV_COLUMNS])
+    print(f"Gathered {len(rows)} results into {root} (crawlDate={crawl_date})")
+
+
+def import_csv(source, crawl_date, root=RESULTS_DATASET_DIR):
+    """
+    Import a historical entiRes.csv (local path or URL) into the dataset.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    df.columns = [c if c.lower() != "codice_ipa" else "Codice_IPA" for c in df.columns]
+    rows = []
+    for record in df.to_dict("records"):
+        rows.append({
+            "Codice_IPA": record.get("Codice_IPA"),
+            "url": _str(record.get("url")),
+            "lighthouseScore": _float(record.get("lighthouseScore")),
+            "firstMeaningfulPaint": _float(record.get("firstMeaningfulPaint")),
+            "totalByteWeight": _float(record.get("totalByteWeight")),
+            "accessibilityScore": _float(record.get("accessibilityScore")),
+            "bootstrap": _bool(record.get("bootstrap")),
+            "bootstrapItalia": _bool(record.get("bootstrapItalia")),
+            "bootstrap2_js": _str(record.get("bootstrap2_js")),
+            "bootstrap2_css": _str(record.get("bootstrap2_css")),
+        })
+    write_partition(rows, crawl_date, root)
+    print(f"Imported {len(rows)} rows from {source} (crawlDate={crawl_date})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the partitioned Parquet results dataset.")
+    parser.add_argument("--root", default=RESULTS_DATASET_DIR, help="Dataset root directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gather_parser = subparsers.add_parser("gather", help="Append entiRes/*.json files to the dataset")
+    gather_parser.add_argument("results_dir", nargs="?", default="entiRes")
+    gather_parser.add_argument("--crawl-date", type=date.fromisoformat, default=date.today())
+    gather_parser.add_argument("--csv", default=None, help="Also write the legacy entiRes.csv")
+
+    import_parser = subparsers.add_parser("import-csv", help="Import a historical entiRes.csv")
+    import_parser.add_argument("source", help="Path or URL of the CSV file")
+    import_parser.add_argument("--crawl-date", type=date.fromisoformat, required=True)
+
+    args = parser.parse_args()
+    if args.command == "gather":
+        gather(args.results_dir, args.crawl_date, args.root, args.csv)
+    else:
+        import_csv(args.source, args.crawl_date, args.root)
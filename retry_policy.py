@@ -0,0 +1,131 @@
+import heapq
+import random
+import re
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+from backoff import backoff_delay
+
+MAX_TEST_ATTEMPTS = 3      # First run included
+RETRY_BASE_DELAY = 30      # Seconds before the first retry
+RETRY_MAX_DELAY = 600      # Upper bound of the retry delay
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# Patterns matched against the error fields of a failed test result, checked in order.
+# Permanent patterns come first: a certificate error wrapped in a timeout message is still permanent.
+FAILURE_PATTERNS = [
+    (PERMANENT, r"Name or service not known|NXDOMAIN|nodename nor servname|No address associated"),
+    (PERMANENT, r"certificate verify failed|CERTIFICATE_VERIFY_FAILED|hostname mismatch|doesn't match|"
+                r"Certificate verification failed|self.signed|certificate has expired"),
+    (PERMANENT, r"Invalid URL|must use HTTPS|Test script .* not found|no hostname found"),
+    (PERMANENT, r"OOMKilled|PidsLimitReached"),
+    (TRANSIENT, r"CPUThrottled"),
+    (TRANSIENT, r"TimeoutExpired|timed out|[Tt]imeout"),
+    (TRANSIENT, r"Temporary failure in name resolution|SERVFAIL|No nameservers"),
+    (TRANSIENT, r"Connection reset|Connection aborted|RemoteDisconnected|EOF occurred|Broken pipe"),
+    (TRANSIENT, r"session deleted|chrome not reachable|Target closed|[Bb]rowser.*(closed|crashed|disconnected)|"
+                r"WebDriverException|Protocol error|Navigation failed because browser has disconnected"),
+    (TRANSIENT, r"Invalid JSON output"),
+]
+
+ERROR_FIELDS = ("error", "error_message", "details")
+
+
+def classify_failure(result):
+    """
+    Classify a failed test result (as stored in crawl_results) as TRANSIENT or PERMANENT.
+    HTTP 5xx and 429 are transient, other HTTP errors permanent; otherwise the error text decides
+    and unknown errors are permanent, so that capacity is not spent on hopeless retries.
+    """
+    status_code = result.get("status_code")
+    if isinstance(status_code, int) and status_code >= 400:
+        return TRANSIENT if status_code >= 500 or status_code == 429 else PERMANENT
+    text = " ".join(str(result.get(field)) for field in ERROR_FIELDS if result.get(field))
+    for failure_class, pattern in FAILURE_PATTERNS:
+        if re.search(pattern, text):
+            return failure_class
+    return PERMANENT
+
+
+def retry_delay(attempt, base=RETRY_BASE_DELAY, maximum=RETRY_MAX_DELAY):
+    """
+    Exponential backoff with jitter (between half and the full delay) before retry number attempt.
+    """
+    delay = backoff_delay(attempt, base, maximum)
+    return random.uniform(delay / 2, delay)
+
+
+class RetryLane:
+    """
+    Delays retries, then hands each of them to submit(lane, fn, *args, **kwargs) when its delay expires
+    (the lane scheduler of the tests, with low-priority retry lanes), so that retries share the workers
+    and the per-lane limits of first attempts instead of running on a pool of their own.
+    A single timer thread keeps the delayed retries.
+    """
+
+    def __init__(self, submit):
+        self.submit = submit
+        self.heap = []
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._dispatch, name="retry-timer", daemon=True)
+        self.thread.start()
+
+    def submit_after(self, delay, lane, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) on lane after delay seconds; returns a Future of its result.
+        """
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("cannot schedule new retries after shutdown")
+            self.counter += 1
+            heapq.heappush(self.heap, (time.monotonic() + delay, self.counter, future, lane, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def pending(self):
+        with self.condition:
+            return len(self.heap)
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.condition.wait(timeout)
+                if self.closed:
+                    return
+                _, _, future, lane, fn, args, kwargs = heapq.heappop(self.heap)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                inner = self.submit(lane, fn, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(lambda f, future=future: self._forward(f, future))
+
+    @staticmethod
+    def _forward(inner, future):
+        if inner.cancelled():
+            future.set_exception(CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+
+    def shutdown(self):
+        """
+        Stop the timer; retries whose delay has not expired yet are cancelled.
+        """
+        with self.condition:
+            self.closed = True
+            for entry in self.heap:
+                entry[2].cancel()
+            self.heap = []
+            self.condition.notify()
@@ -11,9 +11,12 @@ source venv/bin/activate
 
 while true
 do
-	curl -o enti.csv 'https://indicepa.gov.it/ipa-dati/datastore/dump/d09adf99-dc10-4349-8c53-27b1e5aa97b6?bom=True'
+	# Conditional download of the registry, records the entities to crawl first
+	python registry_sync.py --output enti.csv
 	python crawl.py -c crawl.yaml > ../crawl.log 2>&1 
-	git add enti.csv entiRes
-        git commit -m "run $(date)"
+	# Publish only the records whose content changed, volatile fields stay in entiRes
+	python publish.py entiRes --output published
+	git add enti.csv published
+	git diff --cached --quiet || git commit -m "run $(date)"
         sleep 3600
 done 
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import logging
+import math
+import os
+import random
+from collections import Counter, defaultdict
+
+from registry import PROVINCE_FILE, iter_registry, load_regions
+
+SAMPLING_DIR = "sampling_weights"   # One CSV of sampling weights per crawl_id, read by the dashboards
+MARGIN = 0.03           # Target half-width of the confidence interval of a national proportion
+CONFIDENCE_Z = 1.96     # 95% confidence
+MIN_PER_STRATUM = 2     # Units per stratum needed to estimate its variance
+STRATUM_DEPTH = 3       # Components of a stratum: category, region, nature (see stratum_of)
+WEIGHT_COLUMNS = ["Codice_IPA", "stratum", "population", "sampled", "weight"]
+
+
+def sample_size(population, margin=MARGIN, z=CONFIDENCE_Z, p=0.5):
+    """
+    Sample size estimating a proportion within +/- margin, with the finite population correction.
+    p=0.5 is the worst case.
+    """
+    n0 = z * z * p * (1 - p) / (margin * margin)
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+
+def allocate(counts, n):
+    """
+    Allocate exactly n units to the strata ({stratum: population}): MIN_PER_STRATUM units per stratum
+    (or the whole stratum if smaller), the rest proportionally to what is left of each stratum,
+    rounded by largest remainder. Raises ValueError if the minimums alone exceed n (see collapse).
+    """
+    allocation = {stratum: min(population, MIN_PER_STRATUM) for stratum, population in counts.items()}
+    remaining = n - sum(allocation.values())
+    if remaining < 0:
+        raise ValueError(f"{len(counts)} strata need more than {n} units")
+    capacity = {stratum: counts[stratum] - allocation[stratum] for stratum in counts}
+    total = sum(capacity.values())
+    if total == 0:
+        return allocation
+    shares = {stratum: remaining * left / total for stratum, left in capacity.items()}
+    for stratum, share in shares.items():
+        allocation[stratum] += math.floor(share)
+    leftover = remaining - sum(math.floor(share) for share in shares.values())
+    for stratum in sorted(shares, key=lambda s: shares[s] - math.floor(shares[s]), reverse=True)[:leftover]:
+        allocation[stratum] += 1
+    return allocation
+
+
+def collapse(counts, n):
+    """
+    Merge the strata by dropping their last component (nature, then region, then category)
+    until their minimum allocation fits in n units. Returns (depth, merged counts).
+    """
+    depth = STRATUM_DEPTH
+    while True:
+        merged = Counter()
+        for stratum, population in counts.items():
+            merged["|".join(stratum.split("|")[:depth])] += population
+        if depth == 0 or sum(min(population, MIN_PER_STRATUM) for population in merged.values()) <= n:
+            return depth, merged
+        depth -= 1
+
+
+def stratum_of(ente, regions, depth=STRATUM_DEPTH):
+    """
+    Stratum of an entity: category, region and nature, or only the first depth of them.
+    """
+    try:
+        region = regions.get(int(ente.Codice_comune_ISTAT) // 1000, "")
+    except (TypeError, ValueError):
+        region = ""
+    return "|".join([str(ente.Codice_Categoria), region, str(ente.Codice_natura)][:depth])
+
+
+def draw_sample(path, margin=MARGIN, seed=None, filters=None, province_file=PROVINCE_FILE):
+    """
+    Draw a stratified random sample of the registry, streaming it twice:
+    the first pass counts the strata, the second keeps a reservoir per stratum.
+    Strata are collapsed if there are too many of them for the sample size (see collapse).
+    Returns rows with WEIGHT_COLUMNS; weight is population / sampled of the stratum.
+    The same seed draws the same sample, so that a resumed crawl keeps it.
+    """
+    regions = load_regions(province_file)
+    counts = Counter(stratum_of(ente, regions) for ente in iter_registry(path, filters, province_file))
+    target = sample_size(sum(counts.values()), margin)
+    depth, counts = collapse(counts, target)
+    allocation = allocate(counts, target)
+    logging.info(f"Sample of {sum(allocation.values())} entities (target {target}) in {len(counts)} strata "
+                 f"of depth {depth}.")
+
+    rng = random.Random(seed)
+    reservoirs = defaultdict(list)
+    seen = Counter()
+    for ente in iter_registry(path, filters, province_file):
+        stratum = stratum_of(ente, regions, depth)
+        seen[stratum] += 1
+        reservoir = reservoirs[stratum]
+        if len(reservoir) < allocation[stratum]:
+            reservoir.append(ente.Codice_IPA)
+        else:
+            i = rng.randrange(seen[stratum])
+            if i < allocation[stratum]:
+                reservoir[i] = ente.Codice_IPA
+
+    return [
+        {"Codice_IPA": codice_ipa, "stratum": stratum, "population": counts[stratum],
+         "sampled": len(reservoir), "weight": counts[stratum] / len(reservoir)}
+        for stratum, reservoir in sorted(reservoirs.items())
+        for codice_ipa in reservoir
+    ]
+
+
+def write_weights(rows, crawl_id, root=SAMPLING_DIR):
+    """
+    Write the sampling weights of a crawl to <root>/crawlId=<crawl_id>.csv and return the path.
+    They are joined with the results on crawl_id, since a crawl can span several crawl dates.
+    """
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"crawlId={crawl_id}.csv")
+    with open(path + ".tmp", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=WEIGHT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw a stratified sample of the registry and write its weights.")
+    parser.add_argument("registry", nargs="?", default="enti.csv")
+    parser.add_argument("--margin", type=float, default=MARGIN)
+    parser.add_argument("--seed", default=None)
+    parser.add_argument("--crawl-id", required=True)
+    parser.add_argument("--output-dir", default=SAMPLING_DIR)
+    args = parser.parse_args()
+
+    rows = draw_sample(args.registry, args.margin, args.seed if args.seed is not None else args.crawl_id)
+    path = write_weights(rows, args.crawl_id, args.output_dir)
+    print(f"{len(rows)} entities in {len({r['stratum'] for r in rows})} strata written to {path}")
@@ -0,0 +1,174 @@
+import os
+import shutil
+import signal
+import tempfile
+import time
+import uuid
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Delegated cgroup v2 directory under which a child cgroup is created for each sandboxed test
+SANDBOX_CGROUP = os.environ.get("SANDBOX_CGROUP", os.path.join(CGROUP_ROOT, "carbonEnti"))
+CONTROLLERS = ("memory", "cpu", "pids")
+PROFILE_TMPFS_ROOT = "/dev/shm"   # Fallback location of browser profiles when a private tmpfs cannot be mounted
+THROTTLED_FRACTION = 0.1          # A failed test throttled for this fraction of its run time reports CPUThrottled
+
+# Structured failure reasons, from the most to the least specific
+OOM_KILLED = "OOMKilled"
+PIDS_LIMIT_REACHED = "PidsLimitReached"
+CPU_THROTTLED = "CPUThrottled"
+
+
+def _read_keyed(path):
+    """
+    Parse a flat keyed cgroup file ("key value" lines) into a dict of ints; missing files give {}.
+    """
+    values = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if value.strip().isdigit():
+                    values[key] = int(value)
+    except OSError:
+        pass
+    return values
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(str(value))
+
+
+def setup_cgroup_parent(parent=SANDBOX_CGROUP):
+    """
+    Create the parent cgroup of the sandboxes and enable the memory, cpu and pids controllers for its children.
+    Raises OSError when cgroup v2 is not mounted or the parent cannot be delegated to this process.
+    """
+    root_controllers = os.path.join(os.path.dirname(parent), "cgroup.controllers")
+    if not os.path.isfile(root_controllers):
+        raise OSError(f"cgroup v2 is not mounted at {os.path.dirname(parent)}")
+    os.makedirs(parent, exist_ok=True)
+    with open(os.path.join(parent, "cgroup.controllers"), "r") as f:
+        available = f.read().split()
+    missing = [c for c in CONTROLLERS if c not in available]
+    if missing:
+        raise OSError(f"cgroup controllers {missing} are not available in {parent}")
+    _write(os.path.join(parent, "cgroup.subtree_control"), " ".join(f"+{c}" for c in CONTROLLERS))
+
+
+class Sandbox:
+    """
+    A cgroup v2 child of SANDBOX_CGROUP with memory, CPU and process limits for a single test run,
+    plus a private browser profile directory on tmpfs.
+
+    limits keys (all optional): memory_max (e.g. "1536M"), cpu_weight (1-10000), cpu_max
+    (e.g. "200000 100000" for two CPUs), pids_max, tmpfs_size (e.g. "512m").
+    """
+
+    def __init__(self, name, limits, parent=SANDBOX_CGROUP):
+        self.path = os.path.join(parent, f"{name}-{uuid.uuid4().hex[:8]}")
+        self.limits = limits
+        self.started = time.monotonic()
+        os.mkdir(self.path)
+        try:
+            if "memory_max" in limits:
+                _write(os.path.join(self.path, "memory.max"), limits["memory_max"])
+                if os.path.exists(os.path.join(self.path, "memory.swap.max")):
+                    _write(os.path.join(self.path, "memory.swap.max"), 0)
+            if "cpu_weight" in limits:
+                _write(os.path.join(self.path, "cpu.weight"), limits["cpu_weight"])
+            if "cpu_max" in limits:
+                _write(os.path.join(self.path, "cpu.max"), limits["cpu_max"])
+            if "pids_max" in limits:
+                _write(os.path.join(self.path, "pids.max"), limits["pids_max"])
+        except OSError:
+            os.rmdir(self.path)
+            raise
+        # The profile is created under /dev/shm so that it stays on tmpfs even when no private mount is possible
+        profile_root = PROFILE_TMPFS_ROOT if os.path.isdir(PROFILE_TMPFS_ROOT) else None
+        self.profile_dir = tempfile.mkdtemp(prefix="browser-profile-", dir=profile_root)
+
+    def wrap(self, command):
+        """
+        Return command wrapped so that it joins the cgroup before exec, and runs in a private mount
+        namespace with a size-limited tmpfs on the profile directory when unshare is permitted.
+        """
+        wrapped = list(command)
+        if "tmpfs_size" in self.limits and os.geteuid() == 0 and shutil.which("unshare"):
+            wrapped = [
+                "unshare", "--mount", "--propagation", "private", "sh", "-c",
+                'mount -t tmpfs -o "size=$1,mode=700" tmpfs "$0" && shift && exec "$@"',
+                self.profile_dir, self.limits["tmpfs_size"], *wrapped,
+            ]
+        return ["sh", "-c", 'echo $$ > "$0/cgroup.procs" && exec "$@"', self.path, *wrapped]
+
+    def profile_env(self):
+        """
+        Variables added to the environment of the sandboxed test: browser tests read BROWSER_PROFILE_DIR.
+        """
+        return {"BROWSER_PROFILE_DIR": self.profile_dir, "TMPDIR": self.profile_dir}
+
+    def env(self):
+        return dict(os.environ, **self.profile_env())
+
+    def _kill(self):
+        kill_file = os.path.join(self.path, "cgroup.kill")
+        if os.path.exists(kill_file):
+            _write(kill_file, 1)
+            return
+        with open(os.path.join(self.path, "cgroup.procs"), "r") as f:
+            for pid in f.read().split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def report(self):
+        """
+        Return the resource usage of the test and its failure reason, if a limit was hit.
+        """
+        memory_events = _read_keyed(os.path.join(self.path, "memory.events"))
+        cpu_stat = _read_keyed(os.path.join(self.path, "cpu.stat"))
+        pids_events = _read_keyed(os.path.join(self.path, "pids.events"))
+        report = {
+            "oom_kills": memory_events.get("oom_kill", 0),
+            "memory_max_events": memory_events.get("max", 0),
+            "pids_max_events": pids_events.get("max", 0),
+            "cpu_usage_usec": cpu_stat.get("usage_usec"),
+            "nr_throttled": cpu_stat.get("nr_throttled", 0),
+            "throttled_usec": cpu_stat.get("throttled_usec", 0),
+        }
+        try:
+            with open(os.path.join(self.path, "memory.peak"), "r") as f:
+                report["memory_peak"] = int(f.read())
+        except (OSError, ValueError):
+            report["memory_peak"] = None
+
+        elapsed_usec = (time.monotonic() - self.started) * 1e6
+        if report["oom_kills"]:
+            report["failure_reason"] = OOM_KILLED
+        elif report["pids_max_events"]:
+            report["failure_reason"] = PIDS_LIMIT_REACHED
+        elif report["throttled_usec"] >= THROTTLED_FRACTION * elapsed_usec:
+            report["failure_reason"] = CPU_THROTTLED
+        else:
+            report["failure_reason"] = None
+        return report
+
+    def close(self):
+        """
+        Kill whatever is left in the cgroup, remove it with the profile directory and return report().
+        """
+        report = self.report()
+        try:
+            self._kill()
+            for _ in range(50):
+                with open(os.path.join(self.path, "cgroup.procs"), "r") as f:
+                    if not f.read().strip():
+                        break
+                time.sleep(0.1)
+            os.rmdir(self.path)
+        except OSError:
+            pass
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        return report
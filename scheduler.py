@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class DeadlineExceeded(Exception):
+    """
+    Set on the futures of tasks that had not started when the scheduler deadline expired.
+    """
+
+
+class LaneScheduler:
+    """
+    Runs tasks on a fixed pool of workers, with one FIFO lane per task type.
+
+    Without a deadline the workers are shared among the lanes with queued tasks in proportion
+    to their weights (stride scheduling), so a burst of slow tasks cannot starve the quick ones.
+    With a deadline (epoch seconds) the cheapest lane with queued tasks always goes first, and
+    tasks not started when the deadline expires fail with DeadlineExceeded.
+    In both modes a lane never runs more than its limit of tasks at once; lanes of the same group
+    (e.g. the retries of a test type and its first attempts) share the limit of the group lane.
+    """
+
+    def __init__(self, max_workers, lanes=None, deadline=None):
+        """
+        Args:
+            max_workers (int): Number of worker threads.
+            lanes (dict): Lane name -> {"weight": float, "cost": float, "limit": int, "group": str},
+                all optional. Unknown lanes get weight 1, cost 1 and no limit; a lane with a group
+                counts its running tasks against the limit of the group lane.
+            deadline (float): Optional epoch time after which no task is started.
+        """
+        self.lanes = lanes or {}
+        self.deadline = deadline
+        self.queues = {}
+        self.running = {}
+        self.passes = {}
+        self.virtual_time = 0.0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"lane-worker-{i}", daemon=True) for i in range(max_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _config(self, lane, key, default):
+        return self.lanes.get(lane, {}).get(key, default)
+
+    def _limit_reached(self, lane):
+        group = self._config(lane, "group", lane)
+        running = sum(n for l, n in self.running.items() if self._config(l, "group", l) == group)
+        return running >= self._config(group, "limit", float("inf"))
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def remaining(self):
+        """
+        Seconds left before the deadline (None without a deadline).
+        """
+        return None if self.deadline is None else max(0.0, self.deadline - time.time())
+
+    def submit(self, lane, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) on a lane; returns a Future of its result.
+        """
+        future = Future()
+        if self.expired():
+            future.set_exception(DeadlineExceeded(f"Deadline expired before {lane} could start"))
+            return future
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("cannot schedule new tasks after shutdown")
+            queue = self.queues.setdefault(lane, deque())
+            if not queue and self.running.get(lane, 0) == 0:
+                # A lane becoming active starts at the current virtual time, without credit for its idle period
+                self.passes[lane] = max(self.passes.get(lane, 0.0), self.virtual_time)
+            queue.append((future, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def queued(self):
+        """
+        Return {lane: number of queued tasks}.
+        """
+        with self.condition:
+            return {lane: len(queue) for lane, queue in self.queues.items() if queue}
+
+    def _eligible(self):
+        return [
+            lane for lane, queue in self.queues.items() if queue and not self._limit_reached(lane)
+        ]
+
+    def _next(self):
+        """
+        Pop the next task to run, or return None. Must be called with the condition held.
+        """
+        eligible = self._eligible()
+        if not eligible:
+            return None
+        if self.deadline is not None:
+            lane = min(eligible, key=lambda l: self._config(l, "cost", 1))
+        else:
+            lane = min(eligible, key=lambda l: self.passes.get(l, 0.0))
+            self.virtual_time = self.passes.get(lane, 0.0)
+            self.passes[lane] = self.virtual_time + 1.0 / self._config(lane, "weight", 1)
+        self.running[lane] = self.running.get(lane, 0) + 1
+        return (lane, *self.queues[lane].popleft())
+
+    def _drain(self):
+        """
+        Remove every queued task and return [(lane, future)]. Must be called with the condition held.
+        """
+        drained = []
+        for lane, queue in self.queues.items():
+            while queue:
+                drained.append((lane, queue.popleft()[0]))
+        return drained
+
+    def _work(self):
+        while True:
+            expired, task = [], None
+            with self.condition:
+                while True:
+                    if self.expired():
+                        expired = self._drain()
+                        if expired:
+                            break
+                    task = self._next()
+                    if task is not None:
+                        break
+                    if self.closed and not any(self.queues.values()):
+                        return
+                    self.condition.wait(None if self.expired() else self.remaining())
+            # Futures are completed outside the condition: their callbacks may submit new tasks
+            for lane, future in expired:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(DeadlineExceeded(f"Deadline expired before {lane} could start"))
+            if task is None:
+                continue
+            lane, future, fn, args, kwargs = task
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.running[lane] -= 1
+                    self.condition.notify_all()
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting tasks; workers exit once the queued tasks are done (or expired).
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 from pyppeteer import launch
 
 async def verify_bootstrap_italia(url: str) -> dict:
@@ -16,7 +17,11 @@ async def verify_bootstrap_italia(url: str) -> dict:
     """
     browser = None
     try:
-        browser = await launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
+        browser_args = ['--no-sandbox', '--disable-setuid-sandbox']
+        if os.environ.get("BROWSER_PROFILE_DIR"):
+            # Profile on the tmpfs of the crawler sandbox
+            browser_args.append(f"--user-data-dir={os.environ['BROWSER_PROFILE_DIR']}")
+        browser = await launch(headless=True, args=browser_args)
         page = await browser.newPage()
 
         # Navigate to the URL with a timeout (e.g., 30 seconds)
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 import argparse
 import random
 from urllib.parse import urlparse, urljoin
@@ -20,7 +21,11 @@ async def collect_bootstrap_components_union(url, max_clicks=0, min_clicks=0, de
     try:
         if debug:
             print(f"Launching headless browser for URL: {url}")
-        browser = await launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
+        browser_args = ['--no-sandbox', '--disable-setuid-sandbox']
+        if os.environ.get("BROWSER_PROFILE_DIR"):
+            # Profile on the tmpfs of the crawler sandbox
+            browser_args.append(f"--user-data-dir={os.environ['BROWSER_PROFILE_DIR']}")
+        browser = await launch(headless=True, args=browser_args)
         page = await browser.newPage()
 
         if debug:
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import uuid
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from results_store import RESULTS_DATASET_DIR, SCHEMA
+
+# Root of the per-entity change log (changes/crawlDate=YYYY-MM-DD/part-*.parquet + state.parquet)
+TIMESERIES_DIR = "results_timeseries"
+KEYFRAME_INTERVAL = 30  # Crawls between two full keyframes of the same entity
+
+# Fields that change at every crawl and are not tracked
+VOLATILE_FIELDS = {"crawl_id", "Codice_IPA", "ts"}
+TRACKED_FIELDS = [name for name in SCHEMA.names if name not in VOLATILE_FIELDS]
+
+# One row per changed field ("delta") or per field of a full snapshot ("keyframe").
+# Values are JSON encoded so that floats, booleans and strings share a column.
+# ingestedAt orders the changes of an entity ingested more than once for the same crawl date.
+CHANGES_SCHEMA = pa.schema([
+    ("Codice_IPA", pa.string()),
+    ("kind", pa.string()),
+    ("field", pa.string()),
+    ("value", pa.string()),
+    ("previous", pa.string()),
+    ("ingestedAt", pa.timestamp("us")),
+])
+
+# Latest known state of every entity, rewritten at each ingestion
+STATE_SCHEMA = pa.schema([
+    ("Codice_IPA", pa.string()),
+    ("lastCrawlDate", pa.date32()),
+    ("crawlsSinceKeyframe", pa.int32()),
+    ("state", pa.string()),
+])
+
+
+def _encode(value):
+    return json.dumps(value)
+
+
+def _changes_dataset(root):
+    changes_dir = os.path.join(root, "changes")
+    if not os.path.isdir(changes_dir):
+        return None
+    return ds.dataset(changes_dir, format="parquet", schema=CHANGES_SCHEMA.append(pa.field("crawlDate", pa.date32())),
+                      partitioning=ds.partitioning(pa.schema([("crawlDate", pa.date32())]), flavor="hive"))
+
+
+def load_state(root=TIMESERIES_DIR):
+    """
+    Return {Codice_IPA: {"lastCrawlDate", "crawlsSinceKeyframe", "state"}}.
+    """
+    path = os.path.join(root, "state.parquet")
+    if not os.path.exists(path):
+        return {}
+    return {
+        row["Codice_IPA"]: {
+            "lastCrawlDate": row["lastCrawlDate"],
+            "crawlsSinceKeyframe": row["crawlsSinceKeyframe"],
+            "state": json.loads(row["state"]),
+        }
+        for row in pq.read_table(path).to_pylist()
+    }
+
+
+def save_state(state, root=TIMESERIES_DIR):
+    rows = [
+        {"Codice_IPA": codice_ipa, "lastCrawlDate": entry["lastCrawlDate"],
+         "crawlsSinceKeyframe": entry["crawlsSinceKeyframe"], "state": json.dumps(entry["state"])}
+        for codice_ipa, entry in sorted(state.items())
+    ]
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, "state.parquet")
+    pq.write_table(pa.Table.from_pylist(rows, schema=STATE_SCHEMA), path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+
+
+def read_crawl(crawl_date, dataset_root=RESULTS_DATASET_DIR):
+    """
+    Return {Codice_IPA: row} for a crawl date of the results dataset, keeping the latest row per entity.
+    """
+    partition_dir = os.path.join(dataset_root, f"crawlDate={crawl_date.isoformat()}")
+    rows = {}
+    if not os.path.isdir(partition_dir):
+        return rows
+    table = ds.dataset(partition_dir, format="parquet", schema=SCHEMA).to_table()
+    for row in sorted(table.to_pylist(), key=lambda r: (r.get("ts") is not None, r.get("ts"))):
+        if row.get("Codice_IPA"):
+            rows[row["Codice_IPA"]] = row
+    return rows
+
+
+def ingest(crawl_date, dataset_root=RESULTS_DATASET_DIR, root=TIMESERIES_DIR):
+    """
+    Append the changes of a crawl of the results dataset to the change log.
+    Entities ingested for a later date, or for this date with the same content, are skipped,
+    so ingestion can be repeated as a resumed crawl completes more tests.
+    """
+    state = load_state(root)
+    changes = []
+    ingested_at = datetime.now()
+    for codice_ipa, row in read_crawl(crawl_date, dataset_root).items():
+        current = {field: _encode(row.get(field)) for field in TRACKED_FIELDS}
+        entry = state.get(codice_ipa)
+        if entry is not None and (entry["lastCrawlDate"] > crawl_date
+                                  or entry["lastCrawlDate"] == crawl_date and entry["state"] == current):
+            continue
+        same_day = entry is not None and entry["lastCrawlDate"] == crawl_date
+
+        previous = entry["state"] if entry is not None else {}
+        for field in TRACKED_FIELDS:
+            if entry is not None and previous.get(field, _encode(None)) != current[field]:
+                changes.append({"Codice_IPA": codice_ipa, "kind": "delta", "field": field,
+                                "value": current[field], "previous": previous.get(field), "ingestedAt": ingested_at})
+
+        if same_day:
+            # An update of the same crawl is not a new crawl for the keyframe interval
+            crawls_since_keyframe = entry["crawlsSinceKeyframe"]
+        elif entry is None or entry["crawlsSinceKeyframe"] + 1 >= KEYFRAME_INTERVAL:
+            changes.extend(
+                {"Codice_IPA": codice_ipa, "kind": "keyframe", "field": field, "value": value, "previous": None,
+                 "ingestedAt": ingested_at}
+                for field, value in current.items()
+            )
+            crawls_since_keyframe = 0
+        else:
+            crawls_since_keyframe = entry["crawlsSinceKeyframe"] + 1
+        state[codice_ipa] = {"lastCrawlDate": crawl_date, "crawlsSinceKeyframe": crawls_since_keyframe,
+                             "state": current}
+
+    if changes:
+        partition_dir = os.path.join(root, "changes", f"crawlDate={crawl_date.isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        # Sorted by entity so that row group statistics prune per-entity lookups
+        changes.sort(key=lambda c: (c["Codice_IPA"], c["kind"], c["field"]))
+        path = os.path.join(partition_dir, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(pa.Table.from_pylist(changes, schema=CHANGES_SCHEMA), path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+    save_state(state, root)
+    deltas = sum(1 for c in changes if c["kind"] == "delta")
+    print(f"Ingested crawlDate={crawl_date}: {deltas} changed fields, {len(changes) - deltas} keyframe fields")
+
+
+def _change_order(row):
+    return row["crawlDate"], row.get("ingestedAt") or datetime.min
+
+
+def state_at(codice_ipa, when, root=TIMESERIES_DIR):
+    """
+    Return the tracked fields of an entity as of the crawl date when (None if not crawled yet).
+    """
+    dataset = _changes_dataset(root)
+    if dataset is None:
+        return None
+    rows = dataset.to_table(
+        filter=(ds.field("Codice_IPA") == codice_ipa) & (ds.field("crawlDate") <= when),
+        columns=["kind", "field", "value", "crawlDate", "ingestedAt"],
+    ).to_pylist()
+    keyframes = [_change_order(r) for r in rows if r["kind"] == "keyframe"]
+    if not keyframes:
+        return None
+    keyframe_order = max(keyframes)
+
+    state = {}
+    for row in sorted(rows, key=_change_order):
+        if row["kind"] == "keyframe" and _change_order(row) == keyframe_order:
+            state[row["field"]] = json.loads(row["value"])
+        elif row["kind"] == "delta" and _change_order(row) > keyframe_order:
+            state[row["field"]] = json.loads(row["value"])
+    return state
+
+
+def changed(field, since, until, root=TIMESERIES_DIR):
+    """
+    Return the entities whose field changed in the crawls after since and up to until,
+    as a list of {"Codice_IPA", "crawlDate", "previous", "value"}.
+    """
+    dataset = _changes_dataset(root)
+    if dataset is None:
+        return []
+    rows = dataset.to_table(
+        filter=(ds.field("kind") == "delta") & (ds.field("field") == field)
+        & (ds.field("crawlDate") > since) & (ds.field("crawlDate") <= until),
+        columns=["Codice_IPA", "crawlDate", "previous", "value"],
+    ).to_pylist()
+    for row in rows:
+        row["previous"] = json.loads(row["previous"]) if row["previous"] is not None else None
+        row["value"] = json.loads(row["value"])
+    return sorted(rows, key=lambda r: (r["crawlDate"], r["Codice_IPA"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-entity change log of the results dataset.")
+    parser.add_argument("--root", default=TIMESERIES_DIR, help="Change log root directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Append a crawl of the results dataset")
+    ingest_parser.add_argument("--crawl-date", type=date.fromisoformat, default=date.today())
+    ingest_parser.add_argument("--dataset", default=RESULTS_DATASET_DIR, help="Results dataset root")
+
+    state_parser = subparsers.add_parser("state", help="State of an entity at a date")
+    state_parser.add_argument("codice_ipa")
+    state_parser.add_argument("--at", type=date.fromisoformat, default=date.today())
+
+    changed_parser = subparsers.add_parser("changed", help="Entities whose field changed between two crawls")
+    changed_parser.add_argument("field", choices=TRACKED_FIELDS)
+    changed_parser.add_argument("--since", type=date.fromisoformat, required=True)
+    changed_parser.add_argument("--until", type=date.fromisoformat, default=date.today())
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        ingest(args.crawl_date, args.dataset, args.root)
+    elif args.command == "state":
+        print(json.dumps(state_at(args.codice_ipa, args.at, args.root), indent=2))
+    else:
+        for change in changed(args.field, args.since, args.until, args.root):
+            print(json.dumps(change, default=str))
@@ -0,0 +1,108 @@
+import logging
+from urllib.parse import urlsplit
+
+import requests
+
+PROBE_TIMEOUT = 10   # Seconds for each probe request
+MAX_REDIRECTS = 10
+USER_AGENT = "Mozilla/5.0 (compatible; carbonEnti)"
+BLOCKED_STATUSES = (401, 403, 429)   # Statuses of sites refusing the probe (WAF, rate limit) rather than broken
+
+
+def canonical_target(url):
+    """
+    Key grouping the entities that share a site: scheme, host case, www. and trailing slash are ignored.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host + parts.path.rstrip("/") + ("?" + parts.query if parts.query else "")
+
+
+def resolved_target(url):
+    """
+    Key of a resolved URL whose test results can be shared: only the host case and the trailing slash
+    are ignored, the scheme and www. are kept since the SSL and HTTP tests depend on them.
+    """
+    parts = urlsplit(url.strip())
+    return (parts.scheme.lower() + "://" + parts.netloc.lower() + parts.path.rstrip("/")
+            + ("?" + parts.query if parts.query else ""))
+
+
+def candidate_urls(url):
+    """
+    Return the scheme and www. variants of a registry URL, most likely first:
+    https://host, https://www.host (or without www.), http://host, http://www-variant.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if not host:
+        return []
+    alt_host = host[4:] if host.startswith("www.") else "www." + host
+    rest = parts.path or "/"
+    if parts.query:
+        rest += "?" + parts.query
+    return [f"{scheme}://{h}{rest}" for scheme in ("https", "http") for h in (host, alt_host)]
+
+
+def probe(url, session=None, timeout=PROBE_TIMEOUT):
+    """
+    Return (final URL after following redirects, status code) if the host answers, else None.
+    Any HTTP response, even an error status, proves the host is alive: only connection
+    and DNS errors return None.
+    """
+    session = session or requests
+    try:
+        response = session.head(url, timeout=timeout, allow_redirects=True, headers={"User-Agent": USER_AGENT})
+        if response.status_code in (403, 405, 501):
+            # Some servers refuse HEAD
+            response = session.get(url, timeout=timeout, allow_redirects=True, stream=True,
+                                   headers={"User-Agent": USER_AGENT})
+            response.close()
+    except (requests.RequestException, ValueError) as e:
+        logging.debug("probe {} failed: {}".format(url, e))
+        return None
+    if response.status_code >= 400:
+        logging.debug("probe {} returned {}".format(url, response.status_code))
+    return response.url, response.status_code
+
+
+def resolve_url(url, cached=None, session=None, timeout=PROBE_TIMEOUT):
+    """
+    Return the working canonical URL of a site, or None if no variant answers.
+    The first variant answering with a non-error status wins; if every variant answers
+    with an error (e.g. a WAF refusing the user agent), the first one that answered is used,
+    so that the tests (tests/test_http.py can get past such a WAF) still run.
+    A cached canonical URL is checked first with a single probe and kept if it answers
+    with a non-error status or one of BLOCKED_STATUSES.
+    """
+    fallback = None
+    if cached:
+        answer = probe(cached, session, timeout)
+        if answer and (answer[1] < 400 or answer[1] in BLOCKED_STATUSES):
+            return answer[0]
+        fallback = answer and answer[0]
+    if not url:
+        return fallback
+    with requests.Session() as own_session:
+        own_session.max_redirects = MAX_REDIRECTS
+        for candidate in candidate_urls(url):
+            if candidate == cached:
+                continue
+            answer = probe(candidate, session or own_session, timeout)
+            if answer is None:
+                continue
+            final, status = answer
+            if status < 400:
+                logging.info("resolve_url {} -> {}".format(url, final))
+                return final
+            fallback = fallback or final
+    if fallback:
+        logging.info("resolve_url {} -> {} (answers with an error status)".format(url, fallback))
+    else:
+        logging.info("resolve_url {}: no working variant".format(url))
+    return fallback
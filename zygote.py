@@ -0,0 +1,268 @@
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+TESTS_DIR = "tests"
+MAX_MESSAGE = 1 << 16
+
+
+def preload(tests_dir=TESTS_DIR):
+    """
+    Import every test module (without running its __main__ block) so that its dependencies
+    are loaded once in the zygote and shared copy-on-write by the forked children.
+    """
+    for path in sorted(glob.glob(os.path.join(tests_dir, "test_*.py"))):
+        name = "_preload_" + os.path.splitext(os.path.basename(path))[0]
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            spec.loader.exec_module(importlib.util.module_from_spec(spec))
+        except Exception as e:
+            print(f"zygote: cannot preload {path}: {e}", file=sys.stderr)
+
+
+def run_child(request, fds):
+    """
+    Body of a forked child: run the test script as __main__ with the given stdout/stderr. Never returns.
+    """
+    code = 1
+    try:
+        os.setsid()  # Own process group, killed with os.killpg like a subprocess started with start_new_session
+        if request.get("cgroup"):
+            with open(os.path.join(request["cgroup"], "cgroup.procs"), "w") as f:
+                f.write(str(os.getpid()))
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in (devnull, *fds):
+            os.close(fd)
+        os.environ.update(request.get("env") or {})
+        tempfile.tempdir = None
+        sys.argv = [request["script"], *request.get("args", [])]
+        try:
+            runpy.run_path(request["script"], run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def serve(socket_path, tests_dir=TESTS_DIR):
+    """
+    Preload the test modules, then fork a child for each request received on the Unix socket.
+    A request carries the script, its arguments, extra environment, an optional cgroup and the
+    stdout/stderr pipes; the zygote answers with the child pid and later with its return code.
+    """
+    preload(tests_dir)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(64)
+
+    # SIGCHLD wakes up the selector through a pipe instead of interrupting the loop
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, "accept")
+    selector.register(wakeup_r, selectors.EVENT_READ, "wakeup")
+    children = {}  # pid -> connection waiting for the return code
+    print("ready", flush=True)
+
+    try:
+        while True:
+            for key, _ in selector.select():
+                if key.data == "accept":
+                    conn, _ = listener.accept()
+                    try:
+                        data, fds, _, _ = socket.recv_fds(conn, MAX_MESSAGE, 2)
+                        request = json.loads(data)
+                        if len(fds) != 2:
+                            raise ValueError("expected the stdout and stderr pipes")
+                    except (OSError, ValueError) as e:
+                        print(f"zygote: bad request: {e}", file=sys.stderr)
+                        conn.close()
+                        continue
+                    pid = os.fork()
+                    if pid == 0:
+                        signal.set_wakeup_fd(-1)
+                        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                        selector.close()
+                        listener.close()
+                        for fd in (wakeup_r, wakeup_w):
+                            os.close(fd)
+                        for other in children.values():
+                            other.close()
+                        conn.close()
+                        run_child(request, fds)
+                    for fd in fds:
+                        os.close(fd)
+                    children[pid] = conn
+                    conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+                else:
+                    try:
+                        while os.read(wakeup_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    while children:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                        if pid == 0:
+                            break
+                        conn = children.pop(pid, None)
+                        if conn is not None:
+                            try:
+                                conn.sendall(json.dumps({"returncode": os.waitstatus_to_exitcode(status)}).encode() + b"\n")
+                            except OSError:
+                                pass
+                            conn.close()
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+class ZygoteProcess:
+    """
+    Handle of a test forked by the zygote, with the subset of subprocess.Popen used by the crawler:
+    pid (also the process group id), returncode and communicate(timeout).
+    """
+
+    def __init__(self, conn, stdout, stderr, args):
+        self.conn = conn
+        self.args = args
+        self.returncode = None
+        self.stdout_fd = stdout
+        self.stderr_fd = stderr
+        self.conn_fd = conn.fileno()
+        self.buffers = {stdout: [], stderr: [], self.conn_fd: []}
+        self.open_fds = {stdout, stderr, self.conn_fd}
+        data = b""
+        while b"\n" not in data:
+            chunk = conn.recv(MAX_MESSAGE)
+            if not chunk:
+                raise OSError("zygote closed the connection")
+            data += chunk
+        line, rest = data.split(b"\n", 1)
+        self.pid = json.loads(line)["pid"]
+        # The return code of a test that exited right away may arrive with the pid
+        self.buffers[self.conn_fd].append(rest)
+
+    def communicate(self, timeout=None):
+        """
+        Read stdout and stderr until EOF and wait for the return code.
+        Raises subprocess.TimeoutExpired after timeout seconds; a later call resumes the reading.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            for fd in self.open_fds:
+                selector.register(fd, selectors.EVENT_READ)
+            while self.open_fds:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.args, timeout)
+                for key, _ in selector.select(remaining):
+                    chunk = os.read(key.fd, MAX_MESSAGE)
+                    if chunk:
+                        self.buffers[key.fd].append(chunk)
+                    else:
+                        selector.unregister(key.fd)
+                        self.open_fds.discard(key.fd)
+        self._close()
+        status = b"".join(self.buffers[self.conn_fd]).splitlines()
+        # A zygote that died before reporting leaves the test as killed
+        self.returncode = json.loads(status[-1])["returncode"] if status else -signal.SIGKILL
+        stdout = b"".join(self.buffers[self.stdout_fd]).decode(errors="replace")
+        stderr = b"".join(self.buffers[self.stderr_fd]).decode(errors="replace")
+        return stdout, stderr
+
+    def _close(self):
+        for fd in (self.stdout_fd, self.stderr_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.conn.close()
+
+
+class ZygoteClient:
+    """
+    Starts a zygote process and spawns tests through it.
+    """
+
+    def __init__(self, socket_path=None, tests_dir=TESTS_DIR):
+        self.socket_path = socket_path or os.path.join(tempfile.gettempdir(), f"carbonEnti-zygote-{os.getpid()}.sock")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--socket", self.socket_path, "--tests-dir", tests_dir],
+            stdout=subprocess.PIPE, text=True,
+        )
+        ready = self.process.stdout.readline()  # Written once the test modules are preloaded
+        if ready.strip() != "ready":
+            self.process.kill()
+            raise OSError(f"zygote failed to start (exit code {self.process.wait()})")
+
+    def spawn(self, script, args, env=None, cgroup=None):
+        """
+        Fork a child of the zygote running script with args; returns a ZygoteProcess.
+        Raises OSError if the zygote is not available.
+        """
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            request = {"script": script, "args": list(args), "env": env or {}, "cgroup": cgroup}
+            socket.send_fds(conn, [json.dumps(request).encode()], [stdout_w, stderr_w])
+            return ZygoteProcess(conn, stdout_r, stderr_r, [script, *args])
+        except (OSError, ValueError, KeyError):
+            conn.close()
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            raise OSError("zygote unavailable")
+        finally:
+            # Only the child may keep the write ends open, so that EOF marks its exit
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preload the test modules and fork a child for each test.")
+    parser.add_argument("--socket", required=True, help="Unix socket where test requests are received")
+    parser.add_argument("--tests-dir", default=TESTS_DIR)
+    args = parser.parse_args()
+    serve(args.socket, args.tests_dir)